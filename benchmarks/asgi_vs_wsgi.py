@@ -0,0 +1,118 @@
+"""
+Read throughput of the two entry points against the same seeded database:
+gunicorn sync workers (src/wsgi.py) and uvicorn (src/asgi.py), each with the same
+number of worker processes, at several client concurrency levels.
+
+The client is a minimal HTTP/1.1 client on asyncio, so the load generator itself does
+not need a thread per connection; it keeps connections alive wherever the server allows it.
+
+    $ python benchmarks/asgi_vs_wsgi.py --scale 10000 --workers 2 --concurrency 1 16 64 256
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+sys.path.insert(0, HERE)
+from seed import seed  # noqa: E402
+from loadtest import free_port, wait_for_port, percentile  # noqa: E402
+
+def paths(counts):
+    scale, users = counts["characters"], counts["users"]
+    return [
+        lambda i: '/characters?limit=100',
+        lambda i: '/characters/%d' % (i % scale + 1),
+        lambda i: '/planets/%d' % (i * 7 % scale + 1),
+        lambda i: '/user/%d/favorites' % (i % users + 1),
+    ]
+
+def server_command(kind, port, workers):
+    if kind == 'wsgi':
+        return [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC, '-b', '127.0.0.1:%d' % port,
+                '-w', str(workers), '--log-level', 'warning']
+    return [sys.executable, '-m', 'uvicorn', 'asgi:application', '--app-dir', SRC, '--port', str(port),
+            '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+
+async def connection(port, make_path, counter, total, latencies, statuses):
+    reader = writer = None
+    try:
+        while counter[0] < total:
+            i = counter[0]
+            counter[0] += 1
+            began = time.perf_counter()
+            if writer is None:
+                # gunicorn sync workers close the connection after every response
+                reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(('GET %s HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n' % make_path(i)).encode())
+            status_line = await reader.readline()
+            length, close = 0, False
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+                elif name.lower() == 'connection':
+                    close = value.strip().lower() == 'close'
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - began)
+            statuses.append(int(status_line.split()[1]))
+            if close:
+                writer.close()
+                writer = None
+    finally:
+        if writer is not None:
+            writer.close()
+
+async def drive(port, routes, requests, concurrency):
+    latencies, statuses = [], []
+    start = time.perf_counter()
+    for make_path in routes:
+        counter = [0]
+        await asyncio.gather(*(connection(port, make_path, counter, requests, latencies, statuses)
+                               for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "errors": sum(1 for status in statuses if status >= 500),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 16, 64, 256])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per route and concurrency level')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        counts = seed(create_engine(url), args.scale, None, 20)
+        # the response cache would hide the database work on both sides
+        env = dict(os.environ, DATABASE_URL=url, CACHE_BACKEND='none', RATELIMIT_ENABLED='0')
+        print('%-6s %12s %10s %10s %10s %8s' % ('server', 'concurrency', 'rps', 'p50 ms', 'p99 ms', 'errors'))
+        for kind in ('wsgi', 'asgi'):
+            port = free_port()
+            server = subprocess.Popen(server_command(kind, port, args.workers), env=env)
+            try:
+                wait_for_port(port)
+                for concurrency in args.concurrency:
+                    row = asyncio.run(drive(port, paths(counts), args.requests, concurrency))
+                    print('%-6s %12d %10.1f %10.2f %10.2f %8d' % (kind, concurrency, row["rps"], row["p50_ms"], row["p99_ms"], row["errors"]))
+            finally:
+                server.terminate()
+                server.wait()
+
+if __name__ == '__main__':
+    main()
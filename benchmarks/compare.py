@@ -0,0 +1,45 @@
+"""
+Compares two loadtest.py result files route by route.
+
+    $ python benchmarks/compare.py old.json new.json --threshold 10
+"""
+import argparse
+import json
+import sys
+
+METRICS = ("p50_ms", "p95_ms", "p99_ms", "rps")
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10, help='percent change flagged as a regression')
+    args = parser.parse_args()
+    with open(args.old) as handle:
+        old = json.load(handle)
+    with open(args.new) as handle:
+        new = json.load(handle)
+
+    print('%s (%s) -> %s (%s)' % (old.get("commit"), old.get("mode"), new.get("commit"), new.get("mode")))
+    print('%-32s ' % 'route' + ' '.join('%16s' % metric for metric in METRICS))
+    regressions = 0
+    for name in sorted(set(old["routes"]) & set(new["routes"])):
+        cells = []
+        for metric in METRICS:
+            delta = change(old["routes"][name].get(metric), new["routes"][name].get(metric))
+            # higher latency or lower throughput is worse
+            worse = delta is not None and (delta < -args.threshold if metric == 'rps' else delta > args.threshold)
+            regressions += worse
+            cells.append('%15s%s' % ('n/a' if delta is None else '%+.1f%%' % delta, '!' if worse else ' '))
+        print('%-32s ' % name + ' '.join(cells))
+    old_rss, new_rss = old["process"].get("peak_rss_kb"), new["process"].get("peak_rss_kb")
+    print('peak rss: %s -> %s KiB' % (old_rss, new_rss))
+    sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Favorites lookup latency as the table grows, with and without the
+(user_id, <entity>_id) unique indexes declared on the Favorites model.
+
+    $ python benchmarks/favorites_lookup.py --sizes 1000 10000 100000 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from models import db, Favorites  # noqa: E402
+
+USERS = 1000
+ENTITIES = 5000
+
+def seed(engine, size, with_indexes):
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if not with_indexes:
+            for index in Favorites.__table__.indexes:
+                connection.execute(text('DROP INDEX %s' % index.name))
+        rows = set()
+        while len(rows) < size:
+            rows.add((random.randint(1, USERS), random.randint(1, ENTITIES)))
+        connection.execute(
+            Favorites.__table__.insert(),
+            [{"user_id": user_id, "character_id": character_id} for user_id, character_id in rows],
+        )
+
+def time_queries(engine, sql, samples):
+    timings = []
+    with engine.connect() as connection:
+        for _ in range(samples):
+            params = {"user_id": random.randint(1, USERS), "character_id": random.randint(1, ENTITIES)}
+            start = time.perf_counter()
+            connection.execute(text(sql), params).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+def run(sizes, samples):
+    queries = {
+        "by_user": "SELECT * FROM favorites WHERE user_id = :user_id",
+        "duplicate_check": "SELECT id FROM favorites WHERE user_id = :user_id AND character_id = :character_id",
+    }
+    print('%-10s %-8s %-16s %10s %10s' % ('rows', 'indexes', 'query', 'p50 ms', 'p95 ms'))
+    for size in sizes:
+        for with_indexes in (False, True):
+            with tempfile.TemporaryDirectory() as tmp:
+                engine = create_engine('sqlite:///' + os.path.join(tmp, 'bench.db'))
+                seed(engine, size, with_indexes)
+                for name, sql in queries.items():
+                    p50, p95 = time_queries(engine, sql, samples)
+                    print('%-10d %-8s %-16s %10.3f %10.3f' % (size, 'yes' if with_indexes else 'no', name, p50, p95))
+                engine.dispose()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--samples', type=int, default=200)
+    args = parser.parse_args()
+    run(args.sizes, args.samples)
@@ -0,0 +1,266 @@
+"""
+Load test for every route of src/app.py.
+
+Seeds a fresh SQLite database at the requested scale, then drives each route either
+in-process through the Flask test client or over HTTP against real gunicorn workers,
+and writes p50/p95/p99 latency, requests per second and peak RSS to a JSON file.
+
+    $ python benchmarks/loadtest.py --scale 1000 --mode client
+    $ python benchmarks/loadtest.py --scale 100000 --mode gunicorn --workers 4 --concurrency 16
+    $ python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from sqlalchemy import create_engine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+sys.path.insert(0, SRC)
+sys.path.insert(0, HERE)
+from seed import seed, character_row, planet_row, starship_row  # noqa: E402
+
+# routes that walk a whole table run fewer iterations
+HEAVY = {'export_characters', 'export_users', 'bulk_create_characters'}
+
+def scenarios(counts, run_id):
+    """name -> function(i) returning (method, path, json body or None)"""
+    scale, users = counts["characters"], counts["users"]
+
+    def entity(i):
+        return i % scale + 1
+
+    def user(i):
+        return i % users + 1
+
+    def victim(i):
+        # deletes consume ids from the top of the range, away from the read traffic
+        return scale - i
+
+    rv = {
+        'sitemap': lambda i: ('GET', '/', None),
+        'list_users': lambda i: ('GET', '/user', None),
+        'get_user': lambda i: ('GET', '/user/%d' % user(i), None),
+        # before update_user, which changes the seeded passwords
+        'login': lambda i: ('POST', '/login', {"username": "user%d" % user(i), "password": "password"}),
+        'create_user': lambda i: ('POST', '/user', {"username": "bench%s-%d" % (run_id, i), "email": "bench%s-%d@example.com" % (run_id, i), "password": "x"}),
+        'update_user': lambda i: ('PUT', '/user/%d' % user(i), {"password": "y"}),
+        'delete_user': lambda i: ('DELETE', '/user/%d' % (users - i), None),
+        'user_favorites': lambda i: ('GET', '/user/%d/favorites' % user(i), None),
+        'user_favorites_expanded': lambda i: ('GET', '/user/%d/favorites?expand=1' % user(i), None),
+        'favorites_batch': lambda i: ('POST', '/user/%d/favorites/batch' % user(i), [{"character_id": entity(i * 3 + k)} for k in range(10)]),
+        'cache_stats': lambda i: ('GET', '/cache/stats', None),
+        'metrics': lambda i: ('GET', '/metrics', None),
+        'search': lambda i: ('GET', '/search?q=planet+%d' % entity(i), None),
+        'changes': lambda i: ('GET', '/changes?since=%d&limit=100' % i, None),
+        'popular_characters': lambda i: ('GET', '/stats/popular/characters', None),
+        'export_characters': lambda i: ('GET', '/export/characters', None),
+        'export_users': lambda i: ('GET', '/export/users?format=ndjson', None),
+        'bulk_create_characters': lambda i: ('POST', '/characters/bulk', [character_row(10 ** 9 + i * 100 + k) for k in range(100)]),
+    }
+    for resource_name, single, list_path, make_row in (('character', 'characters', '/characters', character_row),
+                                                       ('planet', 'planets', '/planets', planet_row),
+                                                       ('starship', 'starships', '/starhips', starship_row)):
+        rv['list_' + single] = (lambda path: lambda i: ('GET', path, None))(list_path)
+        rv['list_%s_projected' % single] = (lambda path: lambda i: ('GET', path + '?fields=name&limit=1000', None))(list_path)
+        rv['get_' + resource_name] = (lambda single: lambda i: ('GET', '/%s/%d' % (single, entity(i)), None))(single)
+        rv['create_' + resource_name] = (lambda single, make_row: lambda i: ('POST', '/' + single, make_row(2 * 10 ** 9 + i)))(single, make_row)
+        rv['delete_' + resource_name] = (lambda single: lambda i: ('DELETE', '/%s/%d' % (single, victim(i)), None))(single)
+        rv['add_%s_favorite' % resource_name] = (lambda resource_name, single: lambda i: ('POST', '/user/%d/favorites/%s/%d' % (user(i), single, entity(i * 31)), None))(resource_name, single)
+        rv['delete_%s_favorite' % resource_name] = (lambda resource_name, single: lambda i: ('DELETE', '/user/%d/favorites/%s/%d' % (user(i), single, entity(i * 31)), None))(resource_name, single)
+        rv['bulk_delete_' + single] = (lambda single: lambda i: ('DELETE', '/%s/bulk' % single, {"ids": [victim(10000 + i * 10 + k) for k in range(10)]}))(single)
+    # the jobs queued by the delete and bulk scenarios above
+    rv['get_job'] = lambda i: ('GET', '/jobs/%d' % (i + 1), None)
+    return rv
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies, statuses, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for status in statuses if status >= 500),
+        "status_counts": {str(status): statuses.count(status) for status in sorted(set(statuses))},
+        "rps": len(latencies) / elapsed if elapsed else None,
+        "mean_ms": statistics.mean(latencies) * 1000 if latencies else None,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+    }
+
+def run_client(routes, iterations):
+    from app import create_app  # imported after DATABASE_URL is set
+    client = create_app().test_client()
+    results = {}
+    for name, make_request in routes.items():
+        count = max(1, iterations // 50) if name in HEAVY else iterations
+        latencies, statuses = [], []
+        start = time.perf_counter()
+        for i in range(count):
+            method, path, body = make_request(i)
+            began = time.perf_counter()
+            response = client.open(path, method=method, json=body)
+            response.get_data()
+            latencies.append(time.perf_counter() - began)
+            statuses.append(response.status_code)
+        results[name] = summarize(latencies, statuses, time.perf_counter() - start)
+    # ru_maxrss is in KiB on Linux
+    return results, {"peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def process_tree_hwm_kb(pid):
+    """VmHWM of the gunicorn master plus its workers (Linux only)"""
+    pids = [pid]
+    try:
+        with open('/proc/%d/task/%d/children' % (pid, pid)) as handle:
+            pids += [int(child) for child in handle.read().split()]
+    except OSError:
+        return None
+    total = 0
+    for child in pids:
+        try:
+            with open('/proc/%d/status' % child) as handle:
+                for line in handle:
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+        except OSError:
+            pass
+    return total
+
+def wait_for_port(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit('gunicorn did not start on port %d' % port)
+
+def run_gunicorn(routes, iterations, workers, concurrency, env):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC, '-b', '127.0.0.1:%d' % port,
+         '-w', str(workers), '--log-level', 'warning'],
+        env=env,
+    )
+    local = threading.local()
+
+    def send(method, path, body):
+        if not hasattr(local, 'connection'):
+            local.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        payload = json.dumps(body) if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+        began = time.perf_counter()
+        try:
+            local.connection.request(method, path, body=payload, headers=headers)
+            response = local.connection.getresponse()
+            response.read()
+            status = response.status
+        except (OSError, http.client.HTTPException):
+            local.connection.close()
+            del local.connection
+            status = 599
+        return time.perf_counter() - began, status
+
+    results = {}
+    peak_rss = 0
+    try:
+        wait_for_port(port)
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for name, make_request in routes.items():
+                count = max(1, iterations // 50) if name in HEAVY else iterations
+                start = time.perf_counter()
+                outcomes = list(pool.map(lambda i: send(*make_request(i)), range(count)))
+                elapsed = time.perf_counter() - start
+                results[name] = summarize([latency for latency, _ in outcomes], [status for _, status in outcomes], elapsed)
+                peak_rss = max(peak_rss, process_tree_hwm_kb(server.pid) or 0)
+    finally:
+        server.terminate()
+        server.wait()
+    return results, {"peak_rss_kb": peak_rss or None, "workers": workers, "concurrency": concurrency}
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, default=1000, help='rows per catalog table (1000, 100000, 1000000, ...)')
+    parser.add_argument('--users', type=int, help='defaults to scale / 10')
+    parser.add_argument('--favorites-per-user', type=int, default=20)
+    parser.add_argument('--mode', choices=('client', 'gunicorn'), default='client')
+    parser.add_argument('--iterations', type=int, default=200, help='requests per route')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--only', nargs='*', help='run only these scenario names')
+    parser.add_argument('--output', default=os.path.join(HERE, 'results'))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        started = time.perf_counter()
+        counts = seed(create_engine(url), args.scale, args.users, args.favorites_per_user)
+        seed_seconds = time.perf_counter() - started
+
+        # every benchmark request comes from one address, the limiter would only measure 429s
+        env = dict(os.environ, DATABASE_URL=url, RATELIMIT_ENABLED=os.environ.get('RATELIMIT_ENABLED', '0'))
+        os.environ.update(env)
+        run_id = str(int(time.time()))
+        routes = scenarios(counts, run_id)
+        if args.only:
+            routes = {name: routes[name] for name in args.only}
+
+        if args.mode == 'client':
+            results, process = run_client(routes, args.iterations)
+        else:
+            results, process = run_gunicorn(routes, args.iterations, args.workers, args.concurrency, env)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "mode": args.mode,
+        "scale": counts,
+        "seed_seconds": seed_seconds,
+        "iterations": args.iterations,
+        "cache_backend": os.environ.get('CACHE_BACKEND', 'memory'),
+        "process": process,
+        "routes": results,
+    }
+    os.makedirs(args.output, exist_ok=True)
+    path = os.path.join(args.output, '%s-%s-%s-%d.json' % (
+        datetime.now().strftime('%Y%m%d%H%M%S'), report["commit"] or 'nocommit', args.mode, args.scale))
+    with open(path, 'w') as handle:
+        json.dump(report, handle, indent=2, sort_keys=True)
+
+    print('%-32s %8s %9s %9s %9s %9s' % ('route', 'reqs', 'rps', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, row in results.items():
+        print('%-32s %8d %9.1f %9.2f %9.2f %9.2f' % (name, row["requests"], row["rps"] or 0, row["p50_ms"] or 0, row["p95_ms"] or 0, row["p99_ms"] or 0))
+    print('peak rss: %s KiB, results written to %s' % (process["peak_rss_kb"], path))
+
+if __name__ == '__main__':
+    main()
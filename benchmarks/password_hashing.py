@@ -0,0 +1,58 @@
+"""
+Latency and throughput of PasswordHasher (src/passwords.py) at several scrypt costs.
+
+Each run fires --concurrency callers at a pool of --workers threads allowing
+--max-pending hashes in flight, so callers above the limit are rejected (503 in the API)
+instead of queueing without bound.
+
+    $ python benchmarks/password_hashing.py --costs 12 14 15 16 --workers 4 --concurrency 16
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+from loadtest import percentile  # noqa: E402
+from passwords import PasswordHasher  # noqa: E402
+from utils import Overloaded  # noqa: E402
+
+def attempt(hasher):
+    began = time.perf_counter()
+    try:
+        hasher.hash('correct horse battery staple')
+    except Overloaded:
+        return None
+    return time.perf_counter() - began
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--costs', type=int, nargs='+', default=[12, 14, 15, 16], help='log2 of scrypt n')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, help='defaults to 4 * workers')
+    parser.add_argument('--queue-timeout', type=float, default=0.5)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--hashes', type=int, default=200, help='attempts per cost')
+    args = parser.parse_args()
+
+    print('%-8s %10s %10s %10s %10s %10s' % ('n', 'hashes/s', 'p50 ms', 'p99 ms', 'rejected', 'mem/hash'))
+    for cost in args.costs:
+        hasher = PasswordHasher(n=2 ** cost, workers=args.workers, max_pending=args.max_pending or args.workers * 4,
+                                queue_timeout=args.queue_timeout)
+        with ThreadPoolExecutor(max_workers=args.concurrency) as callers:
+            start = time.perf_counter()
+            outcomes = list(callers.map(lambda _: attempt(hasher), range(args.hashes)))
+            elapsed = time.perf_counter() - start
+        hasher.pool.shutdown()
+        latencies = sorted(latency for latency in outcomes if latency is not None)
+        _, r, _ = hasher.params
+        print('%-8s %10.1f %10.2f %10.2f %10d %8dMiB' % (
+            '2^%d' % cost, len(latencies) / elapsed,
+            (percentile(latencies, 0.50) or 0) * 1000, (percentile(latencies, 0.99) or 0) * 1000,
+            len(outcomes) - len(latencies), 128 * r * 2 ** cost // 2 ** 20))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Wire size and client-side cost of a catalog page in every representation (json,
+columnar, msgpack) and content coding (identity, gzip, br, zstd), plus transfer time
+on a slow mobile link.
+
+    $ python benchmarks/payloads.py --limits 100 1000 --link-kbps 1600
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+from seed import seed  # noqa: E402
+
+ACCEPT = {
+    'json': 'application/json',
+    'columnar': 'application/vnd.starwars.columnar+json',
+    'msgpack': 'application/msgpack',
+}
+
+def decoder(representation, coding):
+    from compression import brotli, zstandard
+    import gzip
+    decompress = {
+        'identity': lambda body: body,
+        'gzip': gzip.decompress,
+        'br': brotli.decompress if brotli else None,
+        'zstd': zstandard.ZstdDecompressor().decompress if zstandard else None,
+    }[coding]
+    if representation == 'msgpack':
+        import msgpack
+        return lambda body: msgpack.unpackb(decompress(body))
+    return lambda body: json.loads(decompress(body))
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--limits', type=int, nargs='+', default=[100, 1000])
+    parser.add_argument('--link-kbps', type=float, default=1600, help='downlink of the simulated mobile connection')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        os.environ.update(DATABASE_URL=url, CACHE_BACKEND='none', RATELIMIT_ENABLED='0')
+        seed(create_engine(url), max(args.limits), users=1, favorites_per_user=0)
+        from app import create_app
+        from compression import CODINGS
+        from formats import MIMETYPES
+        app = create_app()
+        client = app.test_client()
+        representations = [name for name in ACCEPT if ACCEPT[name] in MIMETYPES]
+
+        print('%-6s %-9s %-9s %10s %11s %12s %12s' % ('limit', 'format', 'coding', 'bytes', 'server ms', 'decode ms', 'transfer ms'))
+        for limit in args.limits:
+            for representation in representations:
+                for coding in ['identity'] + CODINGS:
+                    headers = {'Accept': ACCEPT[representation], 'Accept-Encoding': coding}
+                    path = '/characters?limit=%d' % limit
+                    # the first request fills the precompressed cache, the timed ones are served from it
+                    body = client.get(path, headers=headers).data
+                    server = best_of(lambda: client.get(path, headers=headers).data, args.repeat)
+                    decode = decoder(representation, coding)
+                    parse = best_of(lambda: decode(body), args.repeat)
+                    transfer = len(body) * 8 / (args.link_kbps * 1000)
+                    print('%-6d %-9s %-9s %10d %11.2f %12.2f %12.1f' % (
+                        limit, representation, coding, len(body), server * 1000, parse * 1000, transfer * 1000))
+
+if __name__ == '__main__':
+    main()
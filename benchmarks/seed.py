@@ -0,0 +1,89 @@
+"""
+Fills a database with synthetic catalog, user and favorites rows through Core
+executemany inserts, fast enough for the 1M row scales. Core skips the ORM hooks that
+keep favorites_count in step, so the counters are reconciled once at the end.
+
+    $ python benchmarks/seed.py sqlite:////tmp/bench.db --scale 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from models import db, User, Characters, Planets, Starships, Favorites  # noqa: E402
+from popularity import reconcile_all  # noqa: E402
+
+CHUNK_SIZE = 5000
+
+def character_row(i):
+    return {"name": "Character %d" % i, "height": str(150 + i % 80), "mass": str(50 + i % 90),
+            "hair_color": "brown", "skin_color": "fair", "eye_color": "blue",
+            "birth_year": "%dBBY" % (i % 900), "gender": "female" if i % 2 else "male"}
+
+def planet_row(i):
+    return {"name": "Planet %d" % i, "diameter": str(1000 + i % 20000), "rotation_period": str(10 + i % 40),
+            "orbital_period": str(100 + i % 500), "gravity": "1 standard", "population": str(1000 * (i % 5000)),
+            "climate": ("arid", "temperate", "frozen", "murky")[i % 4], "terrain": "desert", "surface_water": str(i % 100)}
+
+def starship_row(i):
+    return {"name": "Starship %d" % i, "model": "Model %d" % (i % 50), "starship_class": "Starfighter",
+            "manufacturer": "Incom Corporation", "cost_in_credits": str(10000 + i % 1000000), "length": str(5 + i % 300),
+            "crew": str(1 + i % 50), "passengers": str(i % 100), "max_atmosphering_speed": str(500 + i % 1000),
+            "hyperdrive_rating": "%.1f" % (0.5 + i % 5), "MGLT": str(50 + i % 100), "cargo_capacity": str(i % 100000),
+            "consumables": "1 week"}
+
+def user_row(i):
+    return {"username": "user%d" % i, "email": "user%d@example.com" % i, "password": "password", "is_active": True}
+
+def favorite_rows(users, scale, per_user):
+    # unique (user, entity) pairs, rotating between the three kinds
+    columns = ("character_id", "planet_id", "starship_id")
+    for user_id in range(1, users + 1):
+        for k in range(per_user):
+            row = dict.fromkeys(columns)
+            row["user_id"] = user_id
+            row[columns[k % 3]] = (user_id * 7919 + k // 3) % scale + 1
+            yield row
+
+def insert_chunks(connection, table, rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            connection.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        connection.execute(table.insert(), chunk)
+
+def seed(engine, scale, users=None, favorites_per_user=20):
+    """Creates the schema and inserts `scale` rows per catalog table, returns the row counts"""
+    users = users or max(1, scale // 10)
+    favorites_per_user = min(favorites_per_user, scale)
+    db.metadata.create_all(engine)
+    with engine.begin() as connection:
+        if connection.execute(select(func.count()).select_from(Characters.__table__)).scalar():
+            raise SystemExit('%s is not empty' % engine.url)
+        insert_chunks(connection, Characters.__table__, (character_row(i) for i in range(1, scale + 1)))
+        insert_chunks(connection, Planets.__table__, (planet_row(i) for i in range(1, scale + 1)))
+        insert_chunks(connection, Starships.__table__, (starship_row(i) for i in range(1, scale + 1)))
+        insert_chunks(connection, User.__table__, (user_row(i) for i in range(1, users + 1)))
+        insert_chunks(connection, Favorites.__table__, favorite_rows(users, scale, favorites_per_user))
+    with Session(engine) as session:
+        reconcile_all(session)
+    return {"characters": scale, "planets": scale, "starships": scale, "users": users,
+            "favorites": users * favorites_per_user}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('url')
+    parser.add_argument('--scale', type=int, default=1000)
+    parser.add_argument('--users', type=int)
+    parser.add_argument('--favorites-per-user', type=int, default=20)
+    args = parser.parse_args()
+    start = time.perf_counter()
+    counts = seed(create_engine(args.url), args.scale, args.users, args.favorites_per_user)
+    print(counts, '%.1fs' % (time.perf_counter() - start))
@@ -0,0 +1,68 @@
+"""
+Microbenchmark: ORM instances + Model.serialize() + stdlib json (the old jsonify path)
+against Row tuples + precompiled keys (src/serializers.py) with stdlib json and orjson.
+
+    $ python benchmarks/serializers.py --rows 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..', 'src'))
+sys.path.insert(0, HERE)
+from seed import seed  # noqa: E402
+from models import Characters  # noqa: E402
+from serializers import columns_for, keys_for, rows_to_dicts, orjson  # noqa: E402
+
+def orm_serialize_stdlib(session):
+    results = [item.serialize() for item in session.query(Characters).all()]
+    return json.dumps(results, separators=(',', ':'), sort_keys=True)
+
+def rows_stdlib(session):
+    rows = session.execute(select(*columns_for(Characters)).order_by(Characters.id))
+    return json.dumps(rows_to_dicts(keys_for(Characters), rows), separators=(',', ':'))
+
+def rows_orjson(session):
+    rows = session.execute(select(*columns_for(Characters)).order_by(Characters.id))
+    return orjson.dumps(rows_to_dicts(keys_for(Characters), rows))
+
+def best_of(function, engine, repeat):
+    timings = []
+    for _ in range(repeat):
+        # fresh session each time so the identity map does not carry over
+        with Session(engine) as session:
+            start = time.perf_counter()
+            function(session)
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    paths = [('orm + serialize() + json', orm_serialize_stdlib), ('rows + json', rows_stdlib)]
+    if orjson is not None:
+        paths.append(('rows + orjson', rows_orjson))
+    print('%-10s %-28s %10s %9s' % ('rows', 'path', 'ms', 'speedup'))
+    for count in args.rows:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine('sqlite:///' + os.path.join(tmp, 'bench.db'))
+            seed(engine, count, users=1, favorites_per_user=0)
+            baseline = None
+            for name, function in paths:
+                elapsed = best_of(function, engine, args.repeat)
+                baseline = baseline or elapsed
+                print('%-10d %-28s %10.2f %8.1fx' % (count, name, elapsed * 1000, baseline / elapsed))
+            engine.dispose()
+
+if __name__ == '__main__':
+    main()
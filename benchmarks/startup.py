@@ -0,0 +1,87 @@
+"""
+Cold start cost of the app: import + create_app() time and RSS in a fresh interpreter,
+with the optional subsystems off and on, then per-worker RSS of a booted gunicorn.
+
+    $ python benchmarks/startup.py --repeat 5 --workers 4
+"""
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from sqlalchemy import create_engine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC = os.path.join(HERE, '..', 'src')
+sys.path.insert(0, HERE)
+from seed import seed  # noqa: E402
+from loadtest import free_port, wait_for_port, process_tree_hwm_kb  # noqa: E402
+
+PROBE = '''
+import json, resource, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+built = time.perf_counter()
+print(json.dumps({"import_ms": (imported - start) * 1000, "create_ms": (built - imported) * 1000,
+                  "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+'''
+
+VARIANTS = (
+    ('api only', {}),
+    ('admin', {'ENABLE_ADMIN': '1'}),
+    ('admin + swagger', {'ENABLE_ADMIN': '1', 'ENABLE_SWAGGER': '1'}),
+)
+
+def probe(env):
+    output = subprocess.check_output([sys.executable, '-c', PROBE], cwd=SRC, env=env, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+def gunicorn_rss(env, workers):
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'wsgi', '--chdir', SRC, '-b', '127.0.0.1:%d' % port,
+         '-w', str(workers), '--log-level', 'warning'], env=env)
+    try:
+        wait_for_port(port)
+        # the port opens before the workers have loaded the app, a request per worker waits for them
+        for _ in range(workers * 2):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            connection.request('GET', '/characters/1')
+            connection.getresponse().read()
+            connection.close()
+        total = process_tree_hwm_kb(server.pid)
+    finally:
+        server.terminate()
+        server.wait()
+    return total
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = 'sqlite:///' + os.path.join(tmp, 'bench.db')
+        seed(create_engine(url), 10, users=1, favorites_per_user=0)
+        print('%-18s %12s %12s %12s %14s' % ('variant', 'import ms', 'create ms', 'rss KiB', 'gunicorn KiB'))
+        for name, flags in VARIANTS:
+            env = dict(os.environ, DATABASE_URL=url, ENABLE_ADMIN='0', ENABLE_SWAGGER='0')
+            env.update(flags)
+            runs = [probe(env) for _ in range(args.repeat)]
+            print('%-18s %12.1f %12.1f %12d %14s' % (
+                name,
+                statistics.median(run["import_ms"] for run in runs),
+                statistics.median(run["create_ms"] for run in runs),
+                statistics.median(run["rss_kb"] for run in runs),
+                gunicorn_rss(env, args.workers)))
+        print('gunicorn column: master + %d workers, VmHWM summed' % args.workers)
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,8 @@ creating_migration ()
   pipenv run upgrade
 }
 
-migrate_upgrade () 
+upgrade () 
 {
-  pipenv run migrate
   pipenv run upgrade
 }
 
@@ -19,6 +18,6 @@ echo 'creating migration'
 creating_migration
 else
 echo 'migrations already created'
-echo 'updating migrations'
-migrate_upgrade
+echo 'applying migrations'
+upgrade
 fi
\ No newline at end of file
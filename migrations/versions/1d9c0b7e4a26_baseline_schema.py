@@ -0,0 +1,93 @@
+"""baseline schema
+
+Revision ID: 1d9c0b7e4a26
+Revises:
+Create Date: 2026-10-18 08:00:00.000000
+
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d9c0b7e4a26'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+VERSIONED_TABLES = ('user', 'characters', 'planets', 'starships', 'favorites')
+
+
+def text_columns(*names):
+    return [sa.Column(name, sa.String(length=50), nullable=False) for name in names]
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('username', sa.String(length=50), nullable=True),
+        sa.Column('email', sa.String(length=50), nullable=False),
+        sa.Column('password', sa.String(length=50), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('username'),
+        sa.UniqueConstraint('email'),
+    )
+    op.create_table(
+        'characters',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        *text_columns('name', 'height', 'mass', 'hair_color', 'skin_color', 'eye_color', 'birth_year', 'gender'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'planets',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        *text_columns('name', 'diameter', 'rotation_period', 'orbital_period', 'gravity', 'population',
+                      'climate', 'terrain', 'surface_water'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'starships',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        *text_columns('name', 'model', 'starship_class', 'manufacturer', 'cost_in_credits', 'length', 'crew',
+                      'passengers', 'max_atmosphering_speed', 'hyperdrive_rating', 'MGLT', 'cargo_capacity',
+                      'consumables'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('name'),
+    )
+    op.create_table(
+        'favorites',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('character_id', sa.Integer(), nullable=True),
+        sa.Column('planet_id', sa.Integer(), nullable=True),
+        sa.Column('starship_id', sa.Integer(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['user.id']),
+        sa.ForeignKeyConstraint(['character_id'], ['characters.id']),
+        sa.ForeignKeyConstraint(['planet_id'], ['planets.id']),
+        sa.ForeignKeyConstraint(['starship_id'], ['starships.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    table_versions = op.create_table(
+        'table_versions',
+        sa.Column('table_name', sa.String(length=50), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('table_name'),
+    )
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    op.bulk_insert(table_versions, [{'table_name': name, 'version': 0, 'updated_at': now} for name in VERSIONED_TABLES])
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    op.drop_table('favorites')
+    op.drop_table('starships')
+    op.drop_table('planets')
+    op.drop_table('characters')
+    op.drop_table('user')
@@ -0,0 +1,38 @@
+"""favorites unique indexes
+
+Revision ID: 3f2a9c1d7e41
+Revises: 1d9c0b7e4a26
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f2a9c1d7e41'
+down_revision = '1d9c0b7e4a26'
+branch_labels = None
+depends_on = None
+
+INDEXES = (
+    ('uq_favorites_user_character', 'character_id'),
+    ('uq_favorites_user_planet', 'planet_id'),
+    ('uq_favorites_user_starship', 'starship_id'),
+)
+
+
+def upgrade():
+    for name, column in INDEXES:
+        # keep the oldest copy of every duplicated favorite so the unique index can be built
+        op.execute(
+            'DELETE FROM favorites WHERE {column} IS NOT NULL AND id NOT IN ('
+            'SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM favorites '
+            'WHERE {column} IS NOT NULL GROUP BY user_id, {column}) AS keepers)'.format(column=column)
+        )
+        op.create_index(name, 'favorites', ['user_id', column], unique=True)
+
+
+def downgrade():
+    for name, _ in INDEXES:
+        op.drop_index(name, table_name='favorites')
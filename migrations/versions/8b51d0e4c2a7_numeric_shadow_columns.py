@@ -0,0 +1,73 @@
+"""numeric shadow columns for catalog filters
+
+Revision ID: 8b51d0e4c2a7
+Revises: 3f2a9c1d7e41
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b51d0e4c2a7'
+down_revision = '3f2a9c1d7e41'
+branch_labels = None
+depends_on = None
+
+NUMERIC_FIELDS = {
+    'characters': ('height', 'mass'),
+    'planets': ('diameter', 'rotation_period', 'orbital_period', 'population', 'surface_water'),
+    'starships': ('cost_in_credits', 'length', 'crew', 'passengers', 'max_atmosphering_speed',
+                  'hyperdrive_rating', 'MGLT', 'cargo_capacity'),
+}
+BATCH_SIZE = 1000
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def parse_number(value):
+    # copy of models.parse_number, migrations must not depend on the current models
+    if value is None:
+        return None
+    match = NUMBER_RE.match(str(value).replace(',', '').strip())
+    return float(match.group()) if match else None
+
+
+def backfill(connection, table_name, fields):
+    table = sa.table(table_name, sa.column('id'), *[sa.column(field) for field in fields],
+                     *[sa.column(field + '_num') for field in fields])
+    update = table.update().where(table.c.id == sa.bindparam('row_id')).values(
+        **{field + '_num': sa.bindparam('new_' + field) for field in fields})
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(table.c.id, *[table.c[field] for field in fields])
+            .where(table.c.id > last_id).order_by(table.c.id).limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        connection.execute(update, [
+            dict({'row_id': row.id}, **{'new_' + field: parse_number(getattr(row, field)) for field in fields})
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def upgrade():
+    connection = op.get_bind()
+    for table_name, fields in NUMERIC_FIELDS.items():
+        for field in fields:
+            op.add_column(table_name, sa.Column(field + '_num', sa.Float(), nullable=True))
+        backfill(connection, table_name, fields)
+        for field in fields:
+            op.create_index('ix_%s_%s_num' % (table_name, field), table_name, [field + '_num'])
+
+
+def downgrade():
+    for table_name, fields in NUMERIC_FIELDS.items():
+        with op.batch_alter_table(table_name) as batch_op:
+            for field in fields:
+                batch_op.drop_index('ix_%s_%s_num' % (table_name, field))
+                batch_op.drop_column(field + '_num')
@@ -0,0 +1,58 @@
+"""favorites_count counters for /stats/popular
+
+Revision ID: a94d6e1f7c58
+Revises: f81b3d5c2e94
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a94d6e1f7c58'
+down_revision = 'f81b3d5c2e94'
+branch_labels = None
+depends_on = None
+
+# catalog table -> favorites column referencing it
+FAVORITE_COLUMNS = {
+    'characters': 'character_id',
+    'planets': 'planet_id',
+    'starships': 'starship_id',
+}
+# same layout as the catalog_search DDL in src/models.py, the update triggers now only fire for these columns
+SEARCH_COLUMNS = {
+    'characters': (1, ('name', 'gender', 'hair_color', 'skin_color', 'eye_color')),
+    'planets': (2, ('name', 'climate', 'terrain')),
+    'starships': (3, ('name', 'model', 'starship_class', 'manufacturer')),
+}
+
+
+def narrow_search_triggers():
+    # an AFTER UPDATE trigger on every column would rewrite the FTS row on each counter change
+    for resource, (code, columns) in SEARCH_COLUMNS.items():
+        body = " || ' ' || ".join('new.%s' % column for column in columns[1:])
+        insert = ("INSERT INTO catalog_search(rowid, resource, entity_id, name, body) "
+                  "VALUES (new.id * 4 + %d, '%s', new.id, new.name, %s);" % (code, resource, body))
+        delete = "DELETE FROM catalog_search WHERE rowid = old.id * 4 + %d;" % code
+        op.execute("DROP TRIGGER IF EXISTS %s_search_update" % resource)
+        op.execute("CREATE TRIGGER %s_search_update AFTER UPDATE OF %s ON %s BEGIN %s %s END"
+                   % (resource, ', '.join(columns), resource, delete, insert))
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        narrow_search_triggers()
+    for table_name, favorite_column in FAVORITE_COLUMNS.items():
+        op.add_column(table_name, sa.Column('favorites_count', sa.Integer(), nullable=False, server_default='0'))
+        op.execute("UPDATE %s SET favorites_count = (SELECT count(*) FROM favorites WHERE favorites.%s = %s.id)"
+                   % (table_name, favorite_column, table_name))
+        op.create_index('ix_%s_popularity' % table_name, table_name, ['favorites_count', 'id'])
+
+
+def downgrade():
+    for table_name in FAVORITE_COLUMNS:
+        op.drop_index('ix_%s_popularity' % table_name, table_name=table_name)
+        op.drop_column(table_name, 'favorites_count')
+    # the narrowed search triggers stay, they index the same columns
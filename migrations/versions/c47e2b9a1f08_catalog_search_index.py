@@ -0,0 +1,66 @@
+"""catalog search index
+
+Revision ID: c47e2b9a1f08
+Revises: 8b51d0e4c2a7
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47e2b9a1f08'
+down_revision = '8b51d0e4c2a7'
+branch_labels = None
+depends_on = None
+
+# same layout as the catalog_search DDL in src/models.py: rowid = id * 4 + code
+RESOURCES = {
+    'characters': (1, ('gender', 'hair_color', 'skin_color', 'eye_color')),
+    'planets': (2, ('climate', 'terrain')),
+    'starships': (3, ('model', 'starship_class', 'manufacturer')),
+}
+
+
+def body_sql(columns, prefix):
+    return " || ' ' || ".join('%s.%s' % (prefix, column) for column in columns)
+
+
+def upgrade_sqlite():
+    op.execute("CREATE VIRTUAL TABLE catalog_search USING fts5("
+               "resource UNINDEXED, entity_id UNINDEXED, name, body, tokenize='unicode61 remove_diacritics 2')")
+    for resource, (code, columns) in RESOURCES.items():
+        insert = ("INSERT INTO catalog_search(rowid, resource, entity_id, name, body) "
+                  "VALUES (new.id * 4 + %d, '%s', new.id, new.name, %s);" % (code, resource, body_sql(columns, 'new')))
+        delete = "DELETE FROM catalog_search WHERE rowid = old.id * 4 + %d;" % code
+        op.execute("CREATE TRIGGER %s_search_insert AFTER INSERT ON %s BEGIN %s END" % (resource, resource, insert))
+        op.execute("CREATE TRIGGER %s_search_delete AFTER DELETE ON %s BEGIN %s END" % (resource, resource, delete))
+        op.execute("CREATE TRIGGER %s_search_update AFTER UPDATE ON %s BEGIN %s %s END" % (resource, resource, delete, insert))
+        # rows written before the index existed
+        op.execute("INSERT INTO catalog_search(rowid, resource, entity_id, name, body) "
+                   "SELECT id * 4 + %d, '%s', id, name, %s FROM %s" % (code, resource, body_sql(columns, resource), resource))
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        upgrade_sqlite()
+    elif dialect == 'postgresql':
+        # trigram indexes serve the ILIKE '%q%' fallback
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for resource in RESOURCES:
+            op.execute('CREATE INDEX ix_%s_name_trgm ON %s USING gin (name gin_trgm_ops)' % (resource, resource))
+    # other engines use LIKE 'prefix%' on the existing unique name index
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for resource in RESOURCES:
+            for suffix in ('insert', 'delete', 'update'):
+                op.execute('DROP TRIGGER IF EXISTS %s_search_%s' % (resource, suffix))
+        op.execute('DROP TABLE IF EXISTS catalog_search')
+    elif dialect == 'postgresql':
+        for resource in RESOURCES:
+            op.execute('DROP INDEX IF EXISTS ix_%s_name_trgm' % resource)
@@ -0,0 +1,33 @@
+"""widen user.password for scrypt hashes
+
+Revision ID: d5e8f3a61b20
+Revises: c47e2b9a1f08
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5e8f3a61b20'
+down_revision = 'c47e2b9a1f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # sqlite does not enforce VARCHAR lengths, rebuilding the table would gain nothing
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    op.alter_column('user', 'password', existing_type=sa.String(length=50), type_=sa.String(length=255),
+                    existing_nullable=False)
+    # existing plaintext rows are rehashed by POST /login the next time each user signs in
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        return
+    # fails while hashed rows are present, they do not fit in 50 characters
+    op.alter_column('user', 'password', existing_type=sa.String(length=255), type_=sa.String(length=50),
+                    existing_nullable=False)
@@ -0,0 +1,36 @@
+"""change log for GET /changes
+
+Revision ID: e2a7c4f9b316
+Revises: d5e8f3a61b20
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c4f9b316'
+down_revision = 'd5e8f3a61b20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'changes',
+        sa.Column('seq', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('resource', sa.String(length=20), nullable=False),
+        sa.Column('entity_id', sa.Integer(), nullable=False),
+        sa.Column('op', sa.String(length=10), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+    )
+    op.create_index('ix_changes_resource_entity', 'changes', ['resource', 'entity_id', 'seq'])
+    # existing rows have no history, clients start from a full download and since=0
+
+
+def downgrade():
+    op.drop_index('ix_changes_resource_entity', table_name='changes')
+    op.drop_table('changes')
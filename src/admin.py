@@ -1,20 +1,139 @@
 import os
 from flask_admin import Admin
+from sqlalchemy import func, text
 from models import db, User, Characters, Planets, Starships, Favorites
+from search import name_condition
+from passwords import get_hasher
 from flask_admin.contrib.sqla import ModelView
+from wtforms import PasswordField, ValidationError
+from wtforms.validators import Optional
+
+MAX_PAGE_SIZE = 200
+
+def indexed_columns(model):
+    """Column names that lead an index (primary key, unique or index=True), sorting on them avoids a table scan"""
+    table = model.__table__
+    names = set(column.name for column in table.primary_key.columns)
+    names.update(column.name for column in table.columns if column.index or column.unique)
+    names.update(list(index.columns)[0].name for index in table.indexes)
+    return names
+
+def sortable_columns(model, columns):
+    # string columns with an indexed numeric shadow sort by the shadow, like the API's ?sort=
+    shadows = {column.info["shadow_of"]: column for column in model.__table__.columns if "shadow_of" in column.info}
+    indexed = indexed_columns(model)
+    sortable = []
+    for name in columns:
+        if name in indexed:
+            sortable.append(name)
+        elif name in shadows:
+            # a one element tuple keeps the list column's name, a bare attribute would be keyed by its own
+            sortable.append((name, (getattr(model, shadows[name].name),)))
+    return sortable
+
+def estimated_count(session, model):
+    """Row estimate without a full count(*): planner statistics on PostgreSQL, max(id) elsewhere"""
+    if session.get_bind().dialect.name == 'postgresql':
+        estimate = session.execute(text("SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)"),
+                                   {"table": model.__tablename__}).scalar()
+        # -1 until the table has been analyzed
+        if estimate is not None and estimate >= 0:
+            return estimate
+    return session.query(func.max(model.id)).scalar() or 0
+
+class LargeTableView(ModelView):
+    """
+    ModelView for tables too large for the defaults: capped page sizes, no count(*)
+    per page load, sorting limited to indexed columns and no relationship fields
+    that would load a whole table into a <select>.
+    """
+    page_size = 50
+    can_set_page_size = True
+    page_size_options = (20, 50, 100, MAX_PAGE_SIZE)
+    # count() is replaced by estimated_count(), filtered lists get the prev/next pager
+    simple_list_pager = True
+    column_default_sort = 'id'
+    column_display_pk = True
+
+    def __init__(self, model, session, **kwargs):
+        # numeric shadows and favorites counters are maintained by the app, never edited by hand
+        derived = tuple(column.name for column in model.__table__.columns
+                        if "shadow_of" in column.info or "counter_of" in column.info)
+        columns = tuple(name for name in model.serialize_fields if name not in (self.column_exclude_list or ()))
+        self.column_list = self.column_list or columns
+        self.column_sortable_list = self.column_sortable_list or sortable_columns(model, columns)
+        self.form_excluded_columns = tuple(self.form_excluded_columns or ()) + derived + ('favorites',)
+        self.column_details_exclude_list = tuple(self.column_details_exclude_list or ()) + derived + ('favorites',)
+        ModelView.__init__(self, model, session, **kwargs)
+
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        page_size = min(page_size or self.page_size, MAX_PAGE_SIZE)
+        count, query = ModelView.get_list(self, page, sort_column, sort_desc, search, filters,
+                                          execute=execute, page_size=page_size)
+        if not search and not filters:
+            count = estimated_count(self.session, self.model)
+        return count, query
+
+class UserView(LargeTableView):
+    # the hash is never shown or edited here, new_password is write-only and hashed like POST /user
+    column_exclude_list = ('password',)
+    form_excluded_columns = ('password',)
+    column_details_exclude_list = ('password',)
+    column_searchable_list = ('username', 'email')
+    form_extra_fields = {
+        'new_password': PasswordField('Password', validators=[Optional()],
+                                      description='Leave empty to keep the current password'),
+    }
+
+    def on_model_change(self, form, model, is_created):
+        if form.new_password.data:
+            model.password = get_hasher().hash(form.new_password.data)
+        elif is_created:
+            raise ValidationError('A password is required to create a user')
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        # prefix match, served by the unique indexes instead of ILIKE '%term%' on every row
+        escaped = search.strip().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        condition = db.or_(User.username.like(escaped + '%', escape='\\'), User.email.like(escaped + '%', escape='\\'))
+        return query.filter(condition), count_query, joins, count_joins
+
+class CatalogView(LargeTableView):
+    column_searchable_list = ('name',)
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        condition = name_condition(self.session, self.model.__tablename__, search.strip())
+        return query.filter(condition), count_query, joins, count_joins
+
+def related_name(view, context, model, name):
+    related = getattr(model, name)
+    return None if related is None else getattr(related, 'name', None) or getattr(related, 'username', None) or related.id
+
+class FavoritesView(LargeTableView):
+    column_list = ('id', 'user', 'character', 'planet', 'starship')
+    column_sortable_list = ('id', ('user', (Favorites.user_id,)))
+    # one LEFT JOIN per relationship instead of a lazy load per row and column
+    column_select_related_list = (Favorites.user, Favorites.character, Favorites.planet, Favorites.starship)
+    column_formatters = {name: related_name for name in ('user', 'character', 'planet', 'starship')}
+    # autocomplete instead of rendering every user / character into the form
+    form_ajax_refs = {
+        'user': {'fields': ('username', 'email'), 'page_size': 10},
+        'character': {'fields': ('name',), 'page_size': 10},
+        'planet': {'fields': ('name',), 'page_size': 10},
+        'starship': {'fields': ('name',), 'page_size': 10},
+    }
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Characters, db.session))
-    admin.add_view(ModelView(Planets, db.session)) 
-    admin.add_view(ModelView(Starships, db.session))
-    admin.add_view(ModelView(Favorites, db.session)) 
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(CatalogView(Characters, db.session))
+    admin.add_view(CatalogView(Planets, db.session))
+    admin.add_view(CatalogView(Starships, db.session))
+    admin.add_view(FavoritesView(Favorites, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
@@ -0,0 +1,271 @@
+"""
+ASGI entry point, an alternative to wsgi.py for async servers:
+
+    $ uvicorn asgi:application --app-dir src --workers 4
+
+The read endpoints (catalog lists and items, users, favorites) are served by async
+handlers on an async SQLAlchemy engine (aiosqlite / asyncpg / aiomysql), so a slow query
+only parks a coroutine instead of a whole worker. Every other route, and the expanded
+favorites view, is handed to the Flask app through asgiref's WsgiToAsgi thread pool,
+so both entry points serve exactly the same API. Native handlers are charged the same
+rate limit costs and concurrency slots as their Flask views (see ratelimit.py), and
+record into the same /metrics series and Server-Timing header (see metrics.py).
+"""
+import json
+import re
+import time
+from urllib.parse import parse_qsl
+
+from asgiref.wsgi import WsgiToAsgi
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import http_date, parse_date, parse_etags
+
+from app import create_app
+from compression import choose_encoding, compressed_body
+from conditional import versions_statement, compute_etag, last_modified, client_freshness, FRESH, UNVERIFIED
+from formats import negotiate
+from metrics import Sample, current_sample, listen_queries, server_timing, timed_dumps
+from database import database_url, env_int
+from models import User, Favorites, Characters, Planets, Starships
+from pagination import page_statement, page_results, next_page_headers
+from ratelimit import client_address
+from serializers import columns_for, keys_for, rows_to_dicts, orjson
+from utils import APIException
+
+ASYNC_DRIVERS = {
+    'sqlite': 'sqlite+aiosqlite',
+    'postgresql': 'postgresql+asyncpg',
+    'mysql': 'mysql+aiomysql',
+}
+
+def async_database_url(url):
+    scheme, rest = url.split('://', 1)
+    return ASYNC_DRIVERS.get(scheme.split('+')[0], scheme) + '://' + rest
+
+@timed_dumps
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+class Request:
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.path = scope['path']
+        self.query_string = scope.get('query_string', b'').decode('latin-1')
+        self.args = MultiDict(parse_qsl(self.query_string, keep_blank_values=True))
+        self.headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope.get('headers', [])}
+
+    @property
+    def full_path(self):
+        # same shape as flask.Request.full_path so both entry points agree on ETags
+        return self.path + '?' + self.query_string
+
+    @property
+    def base_url(self):
+        scheme = self.scope.get('scheme', 'http')
+        host = self.headers.get('host')
+        if host is None:
+            name, port = self.scope.get('server') or ('localhost', None)
+            host = name if port in (None, 80, 443) else '%s:%s' % (name, port)
+        return '%s://%s%s' % (scheme, host, self.path)
+
+class AsyncAPI:
+
+    def __init__(self, wsgi_app, url):
+        options = {}
+        if not url.startswith('sqlite'):
+            options = {"pool_size": env_int('DB_POOL_SIZE', 5), "max_overflow": env_int('DB_MAX_OVERFLOW', 10),
+                       "pool_recycle": env_int('DB_POOL_RECYCLE', 1800), "pool_pre_ping": True}
+        self.engine = create_async_engine(async_database_url(url), **options)
+        self.sessions = async_sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        # the cursor events fire on the sync engine the async one drives
+        listen_queries(self.engine.sync_engine)
+        self.fallback = WsgiToAsgi(wsgi_app)
+        self.config = wsgi_app.config
+        self.compressed = wsgi_app.extensions['compression']
+        self.limiter = wsgi_app.extensions['ratelimit']
+        self.metrics = wsgi_app.extensions['metrics']
+        # endpoint -> url rule, the route label the Flask side records under
+        self.rules = {rule.endpoint: rule.rule for rule in wsgi_app.url_map.iter_rules()}
+        collection = (
+            ('characters', Characters, 'characters', 'character', 'There are no characters', 'The character does not exist'),
+            ('planets', Planets, 'planets', 'planet', 'There are no planets', 'The planet does not exist'),
+            ('starhips', Starships, 'starships', 'starship', 'There are no starships', 'The starship does not exist'),
+        )
+        # (pattern, Flask endpoint, handler, extra args), the endpoint picks the rate limit cost
+        self.routes = []
+        for list_path, model, item_path, item_endpoint, empty, missing in collection:
+            self.routes.append((re.compile(r'^/%s/?$' % list_path), 'api.get_' + item_path, self.list_catalog, (model, empty)))
+            self.routes.append((re.compile(r'^/%s/(\d+)/?$' % item_path), 'api.' + item_endpoint, self.get_item, (model, missing)))
+        self.routes += [
+            (re.compile(r'^/user/?$'), 'api.get_users', self.list_users, ()),
+            (re.compile(r'^/user/(\d+)/?$'), 'api.get_one_user', self.get_item, (User, 'User does not exist')),
+            (re.compile(r'^/user/(\d+)/favorites/?$'), 'api.get_user_favorites', self.user_favorites, ()),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] == 'http' and scope['method'] == 'GET':
+            for pattern, endpoint, handler, extra in self.routes:
+                match = pattern.match(scope['path'])
+                if match:
+                    request = Request(scope)
+                    if negotiate(request.headers.get('accept')) != 'json' or request.args.get('expand') in ('1', 'true'):
+                        # columnar / msgpack representations and relationship loading stay in the Flask views
+                        break
+                    ids = tuple(int(group) for group in match.groups())
+                    sample = Sample()
+                    token = current_sample.set(sample)
+                    try:
+                        status, body, headers = await self.dispatch(request, endpoint, handler, extra + ids)
+                    finally:
+                        current_sample.reset(token)
+                    return await self.respond(send, request, status, body, headers, (self.rules[endpoint], sample))
+        return await self.fallback(scope, receive, send)
+
+    async def dispatch(self, request, endpoint, handler, args):
+        try:
+            limit_headers = self.admit(request, endpoint)
+        except APIException as error:
+            return self.error_response(error)
+        try:
+            status, body, headers = await handler(request, *args)
+        except APIException as error:
+            status, body, headers = self.error_response(error)
+        finally:
+            self.limiter.leave()
+        headers.update(limit_headers)
+        return status, body, headers
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    def admit(self, request, endpoint):
+        """ratelimit.before_request for native handlers, returns the headers after_request would add"""
+        self.limiter.enter()
+        if not self.config['RATELIMIT_ENABLED']:
+            return {}
+        try:
+            remaining = self.limiter.check(self.limiter.client_key(request.headers.get('x-api-key'), self.client_address(request)),
+                                           self.limiter.cost(endpoint))
+        except APIException:
+            self.limiter.leave()
+            raise
+        return {} if remaining is None else {'X-RateLimit-Remaining': int(remaining)}
+
+    def client_address(self, request):
+        client = request.scope.get('client')
+        return client_address(request.headers.get('x-forwarded-for'), client[0] if client else None,
+                              self.limiter.proxy_hops)
+
+    @staticmethod
+    def error_response(error):
+        headers = {}
+        if getattr(error, 'retry_after', None) is not None:
+            headers['Retry-After'] = error.retry_after
+        return error.status_code, dumps(error.to_dict()), headers
+
+    async def respond(self, send, request, status, body, headers, measured=None):
+        if status in (200, 304):
+            headers['Vary'] = 'Accept, Accept-Encoding'
+        if status == 200:
+            coding = choose_encoding(request.headers.get('accept-encoding'))
+            if self.config['COMPRESS_ENABLED'] and coding is not None and len(body) >= self.config['COMPRESS_MIN_SIZE']:
+                etag = headers['ETag'].strip('"')
+                # same cache and tags as compression.compress_response on the Flask side
+                body = compressed_body(self.compressed, body, coding, etag, self.config['COMPRESS_LEVELS'].get(coding))
+                headers.update({'Content-Encoding': coding, 'ETag': '"%s-%s"' % (etag, coding)})
+        if measured is not None:
+            # after compression, like metrics.record_request on the Flask side
+            route, sample = measured
+            duration = time.perf_counter() - sample.start
+            self.metrics.record(route, 'GET', status, duration, sample.queries, sample.sql_time,
+                                sample.serialize_time, len(body))
+            if self.config['METRICS_SERVER_TIMING'] or request.headers.get('x-debug-timing') == '1':
+                headers['Server-Timing'] = server_timing(duration, sample.queries, sample.sql_time, sample.serialize_time)
+        raw_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        raw_headers += [(key.lower().encode('latin-1'), str(value).encode('latin-1')) for key, value in headers.items()]
+        await send({'type': 'http.response.start', 'status': status, 'headers': raw_headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def conditional(self, session, request, table_names):
+        """(validator headers, conditional.client_freshness state) from the same watermarks as conditional.py"""
+        versions = [tuple(row) for row in await session.execute(versions_statement(table_names))]
+        modified = last_modified(versions)
+        state, etag = client_freshness(compute_etag(versions, request.full_path), modified,
+                                       parse_etags(request.headers.get('if-none-match')),
+                                       parse_date(request.headers.get('if-modified-since')))
+        headers = {'ETag': '"%s"' % etag}
+        if modified is not None:
+            headers['Last-Modified'] = http_date(modified)
+        return headers, state
+
+    @staticmethod
+    def found(state, body, headers):
+        # If-Modified-Since and `*` only count once the handler has something to answer 200 with
+        if state == UNVERIFIED:
+            return 304, b'', headers
+        return 200, body, headers
+
+    async def list_catalog(self, request, model, empty_message):
+        async with self.sessions() as session:
+            headers, state = await self.conditional(session, request, (model.__tablename__,))
+            if state == FRESH:
+                return 304, b'', headers
+            statement, fields, limit, sort = page_statement(model, request.args)
+            rows = (await session.execute(statement)).all()
+        results, next_cursor = page_results(model, rows, fields, limit, sort)
+        if results == []:
+            raise APIException(empty_message, status_code=404)
+        headers.update(next_page_headers(request.base_url, request.args.to_dict(), next_cursor))
+        return self.found(state, dumps(results), headers)
+
+    async def get_item(self, request, model, missing_message, item_id):
+        table = model.__tablename__
+        async with self.sessions() as session:
+            headers, state = await self.conditional(session, request, (table,))
+            if state == FRESH:
+                return 304, b'', headers
+            row = (await session.execute(select(*columns_for(model)).where(model.id == item_id))).first()
+        if row is None:
+            raise APIException(missing_message, status_code=404)
+        return self.found(state, dumps(dict(zip(keys_for(model), row))), headers)
+
+    async def list_users(self, request):
+        async with self.sessions() as session:
+            headers, state = await self.conditional(session, request, ('user',))
+            if state == FRESH:
+                return 304, b'', headers
+            rows = await session.execute(select(*columns_for(User)).order_by(User.id))
+            users = rows_to_dicts(keys_for(User), rows)
+        if users == []:
+            raise APIException('There are no users', status_code=404)
+        return self.found(state, dumps(users), headers)
+
+    async def user_favorites(self, request, user_id):
+        async with self.sessions() as session:
+            headers, state = await self.conditional(session, request, ('user', 'favorites', 'characters', 'planets', 'starships'))
+            if state == FRESH:
+                return 304, b'', headers
+            if (await session.execute(select(User.id).where(User.id == user_id))).first() is None:
+                raise APIException('User not found', status_code=404)
+            rows = await session.execute(
+                select(*columns_for(Favorites)).where(Favorites.user_id == user_id).order_by(Favorites.id))
+            favorites = rows_to_dicts(keys_for(Favorites), rows)
+        if not favorites:
+            raise APIException('User has no favorites', status_code=404)
+        return self.found(state, dumps(favorites), headers)
+
+application = AsyncAPI(create_app(), database_url())
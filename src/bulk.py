@@ -0,0 +1,291 @@
+"""
+Batch insert / delete for the catalog tables: every row is validated up front,
+the valid ones are written in chunks inside a single transaction.
+
+Catalog imports and deletes run as background jobs (see jobs.py), the request only
+parses the body. Deletes also remove the favorites pointing at the deleted rows.
+"""
+import json
+from flask import request
+from sqlalchemy import func, insert, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from utils import APIException
+from models import User, Favorites, CATALOG, CHANGE_TABLES, FAVORITE_COLUMNS, bump_table_versions, record_changes, \
+    adjust_favorite_counts, count_favorites
+
+CHUNK_SIZE = 500
+MAX_BULK_ROWS = 10000
+
+# table -> Favorites column referencing it, those favorites go when the row goes
+REFERENCING_COLUMNS = dict(FAVORITE_COLUMNS, user='user_id')
+
+def parse_bulk_body():
+    """Accepts a JSON array, {"items": [...]} or NDJSON (application/x-ndjson)"""
+    if request.mimetype == 'application/x-ndjson':
+        items = []
+        for number, line in enumerate(request.get_data(as_text=True).splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                raise APIException('Invalid JSON on line %d' % number, status_code=400)
+    else:
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get('items')
+    if not isinstance(items, list):
+        raise APIException('Expected a JSON array or NDJSON body', status_code=400)
+    if len(items) > MAX_BULK_ROWS:
+        raise APIException('At most %d rows per request' % MAX_BULK_ROWS, status_code=413)
+    return items
+
+def chunks(items, size=CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def writable_columns(model):
+    # numeric shadow columns and counters are derived, clients never send them
+    return [column for column in model.__table__.columns
+            if not column.primary_key and 'shadow_of' not in column.info and 'counter_of' not in column.info]
+
+def validate_row(model, row):
+    if not isinstance(row, dict):
+        return None, ['Row must be an object']
+    errors = []
+    values = {}
+    for column in writable_columns(model):
+        value = row.get(column.name)
+        if value is None:
+            if not column.nullable:
+                errors.append('%s is required' % column.name)
+            continue
+        if not isinstance(value, str):
+            errors.append('%s must be a string' % column.name)
+        elif column.type.length and len(value) > column.type.length:
+            errors.append('%s is longer than %d characters' % (column.name, column.type.length))
+        else:
+            values[column.name] = value
+    return values, errors
+
+def bulk_create(session, model, items):
+    """Returns the per-row results for parse_bulk_body() items, rows that fail validation are reported and skipped"""
+    results = [None] * len(items)
+    valid = []
+    seen_names = set()
+    for index, row in enumerate(items):
+        values, errors = validate_row(model, row)
+        if not errors and values['name'] in seen_names:
+            errors = ['Duplicate name in request']
+        if errors:
+            results[index] = {"index": index, "status": "error", "errors": errors}
+            continue
+        seen_names.add(values['name'])
+        valid.append((index, values))
+
+    # names are unique, look the taken ones up with one IN query per chunk
+    taken = set()
+    for chunk in chunks([values['name'] for _, values in valid]):
+        taken.update(name for name, in session.query(model.name).filter(model.name.in_(chunk)))
+    to_insert = []
+    for index, values in valid:
+        if values['name'] in taken:
+            results[index] = {"index": index, "status": "error", "errors": ['name already exists']}
+        else:
+            to_insert.append((index, values))
+
+    for chunk in chunks(to_insert):
+        # executemany, no ORM instances are built
+        session.execute(insert(model), [values for _, values in chunk])
+        ids = dict(session.query(model.name, model.id).filter(model.name.in_([values['name'] for _, values in chunk])))
+        for index, values in chunk:
+            results[index] = {"index": index, "status": "created", "id": ids.get(values['name'])}
+        # Core writes skip the after_flush hook in models.py, the change log is written here
+        record_changes(session.connection(), [(model.__tablename__, item_id, 'insert', None) for item_id in sorted(ids.values())])
+    if to_insert:
+        bump_table_versions(session.connection(), [model.__tablename__])
+    session.commit()
+    return summarize(results, 'created')
+
+def parse_bulk_ids():
+    body = request.get_json(silent=True)
+    ids = body.get('ids') if isinstance(body, dict) else body
+    if not isinstance(ids, list) or not all(isinstance(item, int) and not isinstance(item, bool) for item in ids):
+        raise APIException('Expected {"ids": [<int>, ...]}', status_code=400)
+    if len(ids) > MAX_BULK_ROWS:
+        raise APIException('At most %d ids per request' % MAX_BULK_ROWS, status_code=413)
+    return ids
+
+def purge_favorites(session, column, ids):
+    """
+    Deletes the favorites where `column` is in `ids`, one transaction per chunk so a
+    user with a huge list never holds a long write lock. Yields the rows removed per chunk.
+    """
+    while True:
+        rows = session.query(Favorites.id, Favorites.user_id, Favorites.character_id, Favorites.planet_id,
+                             Favorites.starship_id).filter(column.in_(ids)).order_by(Favorites.id).limit(CHUNK_SIZE).all()
+        if not rows:
+            return
+        session.query(Favorites).filter(Favorites.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+        connection = session.connection()
+        # Core writes skip the after_flush hook in models.py, the change log and counters are written here
+        record_changes(connection, [(Favorites.__tablename__, row.id, 'delete', row.user_id) for row in rows])
+        deltas = {}
+        for row in rows:
+            count_favorites(deltas, row, -1)
+        # versions row before the counters, the order track_table_writes locks them in
+        bump_table_versions(connection, [Favorites.__tablename__])
+        adjust_favorite_counts(connection, deltas)
+        session.commit()
+        yield len(rows)
+
+def bulk_delete(session, model, ids, progress=None, resumed=None, checkpoint=None):
+    """
+    Deletes the rows in `ids` of `model` (a catalog table or User) with their favorites.
+    Every chunk commits on its own and then calls progress(done, total), so a retried
+    job only redoes what is left. Before each chunk commits, checkpoint(state) gets
+    {"deleted": [...], "favorites_deleted": n} to store in the same transaction, pass it
+    back as `resumed` on retry so rows an earlier attempt removed still count as deleted.
+    """
+    table = model.__tablename__
+    state = {"deleted": list((resumed or {}).get("deleted", ())),
+             "favorites_deleted": (resumed or {}).get("favorites_deleted", 0)}
+    unique_ids = list(dict.fromkeys(ids))
+    existing = set()
+    for chunk in chunks(unique_ids):
+        existing.update(item_id for item_id, in session.query(model.id).filter(model.id.in_(chunk)))
+
+    column = getattr(Favorites, REFERENCING_COLUMNS[table])
+    done = len(state["deleted"]) + state["favorites_deleted"]
+    total = done + len(existing)
+    for chunk in chunks(sorted(existing)):
+        total += session.query(func.count(Favorites.id)).filter(column.in_(chunk)).scalar()
+    for chunk in chunks(sorted(existing)):
+        for removed in purge_favorites(session, column, chunk):
+            done += removed
+            state["favorites_deleted"] += removed
+            # purge_favorites already committed, progress() or the next chunk commits this
+            if checkpoint:
+                checkpoint(state)
+            if progress:
+                progress(done, total)
+        session.query(model).filter(model.id.in_(chunk)).delete(synchronize_session=False)
+        connection = session.connection()
+        if table in CHANGE_TABLES:
+            record_changes(connection, [(table, item_id, 'delete', None) for item_id in chunk])
+        bump_table_versions(connection, [table])
+        state["deleted"].extend(chunk)
+        if checkpoint:
+            checkpoint(state)
+        session.commit()
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+
+    deleted = set(state["deleted"])
+    results = []
+    reported = set()
+    for index, item_id in enumerate(ids):
+        if item_id in reported:
+            results.append({"index": index, "id": item_id, "status": "error", "errors": ['duplicate id in request']})
+        elif item_id in deleted:
+            results.append({"index": index, "id": item_id, "status": "deleted"})
+        else:
+            results.append({"index": index, "id": item_id, "status": "error", "errors": ['not found']})
+        reported.add(item_id)
+    return dict(summarize(results, 'deleted'), favorites_deleted=state["favorites_deleted"])
+
+def insert_ignoring_conflicts(session, model):
+    """INSERT that skips rows hitting a unique index, where the database supports it"""
+    dialect = session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        return sqlite.insert(model).on_conflict_do_nothing()
+    if dialect == 'postgresql':
+        return postgresql.insert(model).on_conflict_do_nothing()
+    if dialect == 'mysql':
+        return insert(model).prefix_with('IGNORE')
+    return insert(model)
+
+def parse_favorite(item):
+    """{"planet_id": 3} -> ("planets", 3), None when the item is malformed"""
+    if not isinstance(item, dict) or len(item) != 1:
+        return None
+    (key, value), = item.items()
+    resource = next((name for name, column in FAVORITE_COLUMNS.items() if column == key), None)
+    if resource is None or not isinstance(value, int) or isinstance(value, bool):
+        return None
+    return resource, value
+
+def bulk_add_favorites(session, user_id):
+    """
+    Adds a mixed list of favorites with a constant number of queries:
+    one per catalog table for existence, one for duplicates, one executemany insert.
+    """
+    items = parse_bulk_body()
+    if session.get(User, user_id) is None:
+        raise APIException('User not found', status_code=404)
+
+    parsed = [parse_favorite(item) for item in items]
+    wanted = {resource: set() for resource in CATALOG}
+    for entry in parsed:
+        if entry is not None:
+            wanted[entry[0]].add(entry[1])
+
+    found = {}
+    for resource, ids in wanted.items():
+        model = CATALOG[resource]
+        found[resource] = set()
+        for chunk in chunks(sorted(ids)):
+            found[resource].update(item_id for item_id, in session.query(model.id).filter(model.id.in_(chunk)))
+
+    already = set()
+    conditions = [getattr(Favorites, FAVORITE_COLUMNS[resource]).in_(ids) for resource, ids in found.items() if ids]
+    if conditions:
+        rows = session.query(Favorites.character_id, Favorites.planet_id, Favorites.starship_id) \
+            .filter(Favorites.user_id == user_id, or_(*conditions))
+        for row in rows:
+            for resource, column in FAVORITE_COLUMNS.items():
+                if getattr(row, column) is not None:
+                    already.add((resource, getattr(row, column)))
+
+    results = []
+    to_insert = []
+    added = {resource: [] for resource in CATALOG}
+    for index, entry in enumerate(parsed):
+        if entry is None:
+            results.append({"index": index, "status": "error", "errors": ['Expected one of %s with an integer id' % ', '.join(FAVORITE_COLUMNS.values())]})
+            continue
+        resource, item_id = entry
+        result = {"index": index, FAVORITE_COLUMNS[resource]: item_id}
+        if item_id not in found[resource]:
+            result.update(status="error", errors=['%s not found' % resource[:-1].capitalize()])
+        elif entry in already:
+            result.update(status="error", errors=['Already on the favorites list'])
+        else:
+            result["status"] = "added"
+            already.add(entry)
+            to_insert.append({"user_id": user_id, FAVORITE_COLUMNS[resource]: item_id})
+            added[resource].append(item_id)
+        results.append(result)
+
+    if to_insert:
+        # every row needs the same keys for a single executemany
+        # a favorite added concurrently since the duplicate check is skipped, not an error
+        session.execute(insert_ignoring_conflicts(session, Favorites), [dict(dict.fromkeys(FAVORITE_COLUMNS.values()), **row) for row in to_insert])
+        bump_table_versions(session.connection(), [Favorites.__tablename__])
+        # executemany gives no ids back, the change log needs them
+        conditions = [getattr(Favorites, FAVORITE_COLUMNS[resource]).in_(ids) for resource, ids in added.items() if ids]
+        inserted = session.query(Favorites.id, Favorites.character_id, Favorites.planet_id, Favorites.starship_id) \
+            .filter(Favorites.user_id == user_id, or_(*conditions)).order_by(Favorites.id).all()
+        record_changes(session.connection(), [(Favorites.__tablename__, row.id, 'insert', user_id) for row in inserted])
+        # a row added concurrently since the duplicate check is counted twice, reconcile_counts fixes that
+        deltas = {}
+        for row in inserted:
+            count_favorites(deltas, row, 1)
+        adjust_favorite_counts(session.connection(), deltas)
+    session.commit()
+    return summarize(results, 'added')
+
+def summarize(results, ok_status):
+    succeeded = sum(1 for result in results if result["status"] == ok_status)
+    return {ok_status: succeeded, "failed": len(results) - succeeded, "results": results}
@@ -0,0 +1,241 @@
+"""
+Response cache for the catalog GET endpoints.
+Two interchangeable backends: an in-process LRU with TTL and a Redis one,
+FakeRedis can stand in for a real server when running locally.
+Keys carry the table version, a write from any process or tool moves it and
+the old entries are simply never read again.
+"""
+import fnmatch
+import os
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import urlencode
+from flask import Response, current_app, g, request
+from formats import negotiated_format, encode
+from models import db, TableVersion
+
+class BaseCache:
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self._get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self):
+        return {
+            "backend": type(self).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+class NullCache(BaseCache):
+
+    def _get(self, key):
+        return None
+
+    def set(self, key, value, ttl=None):
+        pass
+
+    def invalidate(self, prefix):
+        pass
+
+class LRUCache(BaseCache):
+
+    def __init__(self, max_entries=1024, ttl=60):
+        super().__init__()
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, prefix):
+        with self._lock:
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                del self._items[key]
+
+    def stats(self):
+        rv = super().stats()
+        rv["entries"] = len(self._items)
+        rv["max_entries"] = self.max_entries
+        return rv
+
+class RedisCache(BaseCache):
+
+    def __init__(self, client, ttl=60, namespace='cache:'):
+        super().__init__()
+        self.client = client
+        self.ttl = ttl
+        self.namespace = namespace
+
+    def _get(self, key):
+        # bytes, cached bodies may be MessagePack
+        return self.client.get(self.namespace + key)
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        self.client.set(self.namespace + key, value, ex=ttl or None)
+
+    def invalidate(self, prefix):
+        keys = list(self.client.scan_iter(match=self.namespace + prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+class FakeRedis:
+    """The subset of the redis-py client used by this app, kept in a local dict"""
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._locks = {}
+
+    def _alive(self, name):
+        item = self._data.get(name)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[name]
+            return None
+        return value
+
+    def get(self, name):
+        with self._lock:
+            return self._alive(name)
+
+    def set(self, name, value, ex=None):
+        if isinstance(value, str):
+            value = value.encode()
+        with self._lock:
+            self._data[name] = (value, time.time() + ex if ex else None)
+        return True
+
+    def delete(self, *names):
+        with self._lock:
+            return sum(1 for name in names if self._data.pop(name, None) is not None)
+
+    def scan_iter(self, match='*'):
+        with self._lock:
+            names = [name for name in list(self._data) if self._alive(name) is not None]
+        return iter([name for name in names if fnmatch.fnmatchcase(name, match)])
+
+    def lock(self, name, timeout=None, blocking_timeout=None):
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        return FakeLock(lock, blocking_timeout)
+
+class FakeLock:
+    """acquire() / release() of redis-py's Lock, without the expiry"""
+
+    def __init__(self, lock, blocking_timeout=None):
+        self._lock = lock
+        self.blocking_timeout = blocking_timeout
+
+    def acquire(self):
+        return self._lock.acquire(timeout=-1 if self.blocking_timeout is None else self.blocking_timeout)
+
+    def release(self):
+        self._lock.release()
+
+def redis_client(url):
+    if url == 'fake://':
+        return FakeRedis()
+    # optional dependency, only needed when CACHE_BACKEND=redis
+    import redis
+    return redis.Redis.from_url(url)
+
+def create_cache(backend, ttl=60, max_entries=1024, redis_url=None):
+    if backend == 'memory':
+        return LRUCache(max_entries=max_entries, ttl=ttl)
+    if backend == 'redis':
+        return RedisCache(redis_client(redis_url or 'redis://localhost:6379/0'), ttl=ttl)
+    if backend in ('none', 'null', ''):
+        return NullCache()
+    raise ValueError('Unknown cache backend %r' % backend)
+
+def init_cache(app):
+    app.config.setdefault('CACHE_BACKEND', os.environ.get('CACHE_BACKEND', 'memory'))
+    app.config.setdefault('CACHE_TTL', int(os.environ.get('CACHE_TTL', 60)))
+    app.config.setdefault('CACHE_MAX_ENTRIES', int(os.environ.get('CACHE_MAX_ENTRIES', 1024)))
+    app.config.setdefault('CACHE_REDIS_URL', os.environ.get('REDIS_URL'))
+    app.extensions['cache'] = create_cache(
+        app.config['CACHE_BACKEND'],
+        ttl=app.config['CACHE_TTL'],
+        max_entries=app.config['CACHE_MAX_ENTRIES'],
+        redis_url=app.config['CACHE_REDIS_URL'],
+    )
+    return app.extensions['cache']
+
+def get_cache():
+    return current_app.extensions['cache']
+
+def table_version(resource):
+    if 'table_versions' in g:
+        # the snapshot @conditional computed the ETag from, body and tag describe the same versions
+        return dict((name, version) for name, version, _ in g.table_versions).get(resource, 0)
+    return db.session.query(TableVersion.version).filter(TableVersion.table_name == resource).scalar() or 0
+
+def list_key(resource):
+    # query params are part of the key so every page / projection is cached separately
+    args = sorted(request.args.items(multi=True))
+    return '%s:%d:list:%s' % (resource, table_version(resource), urlencode(args))
+
+def item_key(resource, item_id):
+    return '%s:%d:%s' % (resource, table_version(resource), item_id)
+
+def cached_json(key, build, status=200):
+    """
+    Serves the body stored under `key`, otherwise calls build() -> (payload, headers)
+    and caches the encoded body. Each Accept representation (formats.py) is cached
+    separately. Errors raised by build() are never cached.
+    """
+    cache = get_cache()
+    representation = negotiated_format()
+    if representation != 'json':
+        key = '%s|%s' % (key, representation)
+    value = cache.get(key)
+    if value is None:
+        payload, headers = build()
+        body, mimetype = encode(payload, representation)
+        headers = dict(headers or {}, **{"Content-Type": mimetype})
+        value = current_app.json.dumps(headers).encode() + b'\n' + body
+        cache.set(key, value)
+    headers, body = value.split(b'\n', 1)
+    response = Response(body, status=status, headers=current_app.json.loads(headers))
+    response.vary.add('Accept')
+    return response
+
+def invalidate(resource):
+    """Frees this process' entries for `resource` early, stale ones are never served either way"""
+    get_cache().invalidate(resource + ':')
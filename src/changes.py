@@ -0,0 +1,140 @@
+"""
+Change feed for incremental sync. Every write to the catalog tables and favorites
+appends (seq, resource, id, op) to the changes table, from track_table_writes in
+models.py or explicitly by the Core writes in bulk.py. A client keeps the `next`
+value of its last sync and asks for GET /changes?since=<next>; deletes come back as
+tombstones so it can drop its local copies. Treat insert and update alike (upsert),
+compaction may leave only the newest entry for a row.
+
+`flask compact-changes` keeps the log small: entries superseded by a newer one for
+the same row are dropped, and tombstones older than the retention are removed. A
+`since` older than the newest removed tombstone gets 410 Gone, the client has to
+resync in full.
+
+On PostgreSQL and MySQL a seq is taken at INSERT but becomes visible at COMMIT, so a
+lower seq can show up after a higher one. `next` therefore only moves past entries
+older than CHANGES_GRACE_SECONDS, which must outlast the longest write transaction.
+SQLite commits one writer at a time and needs no grace.
+"""
+from datetime import timedelta
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import exists, func, or_
+from sqlalchemy.orm import aliased
+from utils import APIException
+from pagination import parse_limit
+from models import db, Change, TableVersion, CHANGE_TABLES, utcnow
+
+COMPACT_CHUNK_SIZE = 5000
+# table_versions row whose version is the seq of the newest pruned tombstone
+HORIZON = 'changes_horizon'
+
+def parse_since(raw):
+    if raw is None:
+        return 0
+    try:
+        since = int(raw)
+    except ValueError:
+        raise APIException('since must be an integer', status_code=400)
+    if since < 0:
+        raise APIException('since must not be negative', status_code=400)
+    return since
+
+def parse_user_id(raw):
+    if raw is None:
+        return None
+    try:
+        return int(raw)
+    except ValueError:
+        raise APIException('user_id must be an integer', status_code=400)
+
+def parse_resources(raw):
+    if not raw:
+        return None
+    resources = [name.strip() for name in raw.split(',') if name.strip()]
+    unknown = sorted(set(resources) - set(CHANGE_TABLES))
+    if unknown:
+        raise APIException('Unknown resources: ' + ', '.join(unknown), status_code=400)
+    return resources
+
+def changes_horizon(session):
+    return session.query(TableVersion.version).filter(TableVersion.table_name == HORIZON).scalar() or 0
+
+def safe_watermark(session, grace):
+    """(newest seq a reader may move past, whether newer entries are still settling)"""
+    latest = session.query(func.max(Change.seq)).scalar() or 0
+    if not grace or session.get_bind().dialect.name == 'sqlite':
+        return latest, False
+    cutoff = utcnow() - timedelta(seconds=grace)
+    settled = session.query(func.max(Change.seq)).filter(Change.created_at < cutoff).scalar() or 0
+    return settled, settled < latest
+
+def read_changes(session, args, grace=0):
+    """
+    ({"changes": [...], "next": seq, "more": bool}, settling) for ?since=, optionally
+    narrowed by ?resources=characters,favorites and ?user_id= (favorites of other users
+    are skipped). `settling` is True while entries newer than the page wait out `grace`.
+    """
+    since = parse_since(args.get('since'))
+    limit = parse_limit(args.get('limit'))
+    resources = parse_resources(args.get('resources'))
+    user_id = parse_user_id(args.get('user_id'))
+    if since < changes_horizon(session):
+        raise APIException('since is older than the retained change log, resync in full', status_code=410)
+
+    # read up to a settled watermark so entries committed late, with a lower seq, are not skipped by `next`
+    latest, settling = safe_watermark(session, grace)
+    query = session.query(Change.seq, Change.resource, Change.entity_id, Change.op, Change.user_id) \
+        .filter(Change.seq > since, Change.seq <= latest)
+    if resources is not None:
+        query = query.filter(Change.resource.in_(resources))
+    if user_id is not None:
+        query = query.filter(or_(Change.resource != 'favorites', Change.user_id == user_id))
+    rows = query.order_by(Change.seq).limit(limit + 1).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changes = [{"seq": seq, "resource": resource, "id": entity_id, "op": op, "user_id": owner}
+               for seq, resource, entity_id, op, owner in rows]
+    # with nothing left to read the client may skip past entries its filters left out
+    next_since = rows[-1].seq if more else max(since, latest)
+    return {"changes": changes, "next": next_since, "more": more}, settling
+
+def delete_in_chunks(session, seq_query):
+    removed = 0
+    while True:
+        seqs = [seq for seq, in seq_query.order_by(Change.seq).limit(COMPACT_CHUNK_SIZE)]
+        if not seqs:
+            return removed
+        session.query(Change).filter(Change.seq.in_(seqs)).delete(synchronize_session=False)
+        # short transactions, writers are not blocked for the whole compaction
+        session.commit()
+        removed += len(seqs)
+
+def compact_changes(session, retention):
+    """Returns (superseded entries removed, tombstones removed)"""
+    newer = aliased(Change)
+    superseded = session.query(Change.seq).filter(exists().where(
+        newer.resource == Change.resource, newer.entity_id == Change.entity_id, newer.seq > Change.seq))
+    superseded_removed = delete_in_chunks(session, superseded)
+
+    cutoff = utcnow() - retention
+    expired = session.query(Change.seq).filter(Change.op == 'delete', Change.created_at < cutoff)
+    horizon = expired.with_entities(func.max(Change.seq)).scalar()
+    if horizon is None:
+        return superseded_removed, 0
+    # the horizon moves before the tombstones go, a client never misses one without getting a 410
+    row = session.get(TableVersion, HORIZON)
+    if row is None:
+        session.add(TableVersion(table_name=HORIZON, version=horizon))
+    elif row.version < horizon:
+        row.version, row.updated_at = horizon, utcnow()
+    session.commit()
+    return superseded_removed, delete_in_chunks(session, expired.filter(Change.seq <= horizon))
+
+@click.command('compact-changes')
+@click.option('--retention-days', default=30, show_default=True, help='How long tombstones are kept.')
+@with_appcontext
+def compact_changes_command(retention_days):
+    """Drops superseded change log entries and tombstones past the retention"""
+    superseded, tombstones = compact_changes(db.session, timedelta(days=retention_days))
+    click.echo('removed %d superseded entries and %d tombstones' % (superseded, tombstones))
@@ -0,0 +1,138 @@
+"""
+Content-Encoding negotiation for JSON / MessagePack responses: zstd, brotli or gzip,
+whichever the client accepts with the highest q (server preference on ties), for
+bodies above COMPRESS_MIN_SIZE. zstd and brotli are used when their packages are installed.
+
+Compressed bodies of responses with an ETag are kept in a small LRU keyed by
+ETag and coding, so unchanged data is compressed once, not on every request.
+The compressed representation gets its own strong ETag (<etag>-<coding>).
+"""
+import gzip
+import os
+import zlib
+from flask import current_app, request
+from werkzeug.http import parse_accept_header
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+COMPRESSIBLE = {'application/json', 'application/x-ndjson', 'application/msgpack',
+                'application/vnd.starwars.columnar+json', 'text/plain', 'text/html'}
+DEFAULT_LEVELS = {'zstd': 3, 'br': 5, 'gzip': 6}
+
+CODINGS = ['gzip']
+if brotli is not None:
+    CODINGS.insert(0, 'br')
+if zstandard is not None:
+    CODINGS.insert(0, 'zstd')
+
+def choose_encoding(accept_encoding):
+    """Best coding for an Accept-Encoding value, None for identity"""
+    if not accept_encoding:
+        return None
+    accepted = parse_accept_header(accept_encoding)
+    best, best_quality = None, 0
+    for coding in CODINGS:
+        # explicit entries win over *, so "gzip;q=0, *" still excludes gzip
+        quality = accepted[coding]
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+def compress(body, coding, level=None):
+    level = DEFAULT_LEVELS[coding] if level is None else level
+    if coding == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(body)
+    if coding == 'br':
+        return brotli.compress(body, quality=level)
+    return gzip.compress(body, compresslevel=level, mtime=0)
+
+class StreamCompressor:
+    """Incremental version of compress() for streamed responses"""
+
+    def __init__(self, coding, level=None):
+        level = DEFAULT_LEVELS[coding] if level is None else level
+        if coding == 'zstd':
+            self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        elif coding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+        self.coding = coding
+
+    def compress(self, data):
+        if self.coding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        if self.coding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+def compress_stream(chunks, coding, level=None):
+    compressor = StreamCompressor(coding, level)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def etag_variants(etag):
+    """Every tag a client may hold for `etag`: the identity one and one per coding"""
+    return [etag] + ['%s-%s' % (etag, coding) for coding in CODINGS]
+
+def compressed_body(cache, body, coding, etag, level=None):
+    if etag is None:
+        return compress(body, coding, level)
+    key = '%s-%s' % (etag, coding)
+    value = cache.get(key)
+    if value is None:
+        value = compress(body, coding, level)
+        cache.set(key, value)
+    return value
+
+def compress_response(response):
+    config = current_app.config
+    if response.status_code != 200 or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE or request.method == 'HEAD':
+        return response
+    response.vary.add('Accept-Encoding')
+    coding = choose_encoding(request.headers.get('Accept-Encoding'))
+    if coding is None:
+        return response
+    level = config['COMPRESS_LEVELS'].get(coding)
+    etag, weak = response.get_etag()
+    if response.is_streamed:
+        response.response = compress_stream(response.response, coding, level)
+        response.headers.pop('Content-Length', None)
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+        cache = current_app.extensions['compression']
+        response.set_data(compressed_body(cache, body, coding, None if weak else etag, level))
+    response.headers['Content-Encoding'] = coding
+    if etag is not None:
+        response.set_etag('%s-%s' % (etag, coding), weak=weak)
+    return response
+
+def init_compression(app):
+    app.config.setdefault('COMPRESS_ENABLED', os.environ.get('COMPRESS_ENABLED', '1') == '1')
+    app.config.setdefault('COMPRESS_MIN_SIZE', int(os.environ.get('COMPRESS_MIN_SIZE', 1024)))
+    app.config.setdefault('COMPRESS_CACHE_ENTRIES', int(os.environ.get('COMPRESS_CACHE_ENTRIES', 256)))
+    app.config.setdefault('COMPRESS_LEVELS', {})
+    # entries are keyed by strong ETags, which change with the data, so they never go stale
+    app.extensions['compression'] = LRUCache(max_entries=app.config['COMPRESS_CACHE_ENTRIES'], ttl=0)
+    if app.config['COMPRESS_ENABLED']:
+        app.after_request(compress_response)
+    return app.extensions['compression']
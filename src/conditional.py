@@ -0,0 +1,96 @@
+"""
+Conditional GET support: strong ETags and Last-Modified derived from the table_versions watermarks
+"""
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import g, request, make_response
+from sqlalchemy import select
+from models import db, TableVersion
+from compression import etag_variants
+from formats import negotiated_format
+
+def versions_statement(table_names):
+    return select(TableVersion.table_name, TableVersion.version, TableVersion.updated_at) \
+        .where(TableVersion.table_name.in_(table_names)).order_by(TableVersion.table_name)
+
+def table_versions(table_names):
+    return [tuple(row) for row in db.session.execute(versions_statement(table_names))]
+
+def compute_etag(versions, full_path=None, representation='json'):
+    # the full url is part of the tag so every page / projection gets its own
+    full_path = request.full_path if full_path is None else full_path
+    raw = full_path + '|' + ','.join('%s:%s' % (name, version) for name, version, _ in versions)
+    if representation != 'json':
+        # columnar / msgpack bodies of the same url (formats.py)
+        raw += '|' + representation
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+# client_freshness() states
+FRESH = 'fresh'
+UNVERIFIED = 'unverified'
+
+def last_modified(versions):
+    """
+    The newest watermark in whole seconds, as HTTP dates go. None while that second is
+    still running: a second write within it would carry the same date and an
+    If-Modified-Since revalidation would miss it. The ETag covers those responses.
+    """
+    if not versions:
+        return None
+    modified = max(updated_at for _, _, updated_at in versions).replace(tzinfo=timezone.utc, microsecond=0)
+    if modified >= datetime.now(timezone.utc).replace(microsecond=0):
+        return None
+    return modified
+
+def client_freshness(etag, modified, if_none_match, if_modified_since):
+    """
+    (state, tag to answer with). FRESH when If-None-Match names the current tag or a
+    compressed variant of it: the client got that tag from a 200 of this url at these
+    versions, so the handler would answer 200 again. UNVERIFIED when only `*` or
+    If-Modified-Since vouch for the copy; they match urls that 404 just as well, the
+    handler has to run first. None when the copy is stale.
+    """
+    if if_none_match:
+        # If-None-Match wins over If-Modified-Since (RFC 9110 13.2.2)
+        if if_none_match.star_tag:
+            return UNVERIFIED, etag
+        for variant in etag_variants(etag):
+            if if_none_match.contains(variant):
+                return FRESH, variant
+        return None, etag
+    # a date in the future is invalid and ignored (RFC 9110 13.1.3)
+    if if_modified_since and modified is not None and modified <= if_modified_since <= datetime.now(timezone.utc):
+        return UNVERIFIED, etag
+    return None, etag
+
+def conditional(*table_names):
+    """
+    Decorator for GET handlers whose body only depends on `table_names`.
+    Answers 304 before running the handler when the client holds the current tag, and
+    after it when only If-Modified-Since or `*` match and the handler answered 200.
+    A response marked no-store goes out without validators.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            versions = table_versions(table_names)
+            # cache.py keys bodies on this same snapshot, the body served always matches the tag
+            g.table_versions = versions
+            etag = compute_etag(versions, representation=negotiated_format())
+            modified = last_modified(versions)
+            # answer with the tag the client holds, compressed or not
+            state, etag = client_freshness(etag, modified, request.if_none_match, request.if_modified_since)
+            if state != FRESH:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.cache_control.no_store:
+                    return response
+            if state is not None:
+                response = make_response('', 304)
+                response.vary.update(('Accept', 'Accept-Encoding'))
+            response.set_etag(etag)
+            if modified is not None:
+                response.last_modified = modified
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,70 @@
+"""
+Database selection (DATABASE_URL) and connection pool / SQLite tuning
+"""
+import os
+from sqlalchemy import event
+
+DEFAULT_DATABASE_URL = "sqlite:////tmp/test.db"
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+def env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+def database_url():
+    url = os.environ.get('DATABASE_URL', DEFAULT_DATABASE_URL)
+    # heroku / render still hand out the scheme SQLAlchemy 1.4+ dropped
+    if url.startswith('postgres://'):
+        url = url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def engine_options(url):
+    if url.startswith('sqlite'):
+        # busy timeout is in seconds for the sqlite3 driver
+        return {"connect_args": {"timeout": env_int('SQLITE_BUSY_TIMEOUT_MS', 5000) / 1000}}
+
+    options = {
+        "pool_size": env_int('DB_POOL_SIZE', 5),
+        "max_overflow": env_int('DB_MAX_OVERFLOW', 10),
+        "pool_timeout": env_int('DB_POOL_TIMEOUT', 30),
+        "pool_recycle": env_int('DB_POOL_RECYCLE', 1800),
+        "pool_pre_ping": env_bool('DB_POOL_PRE_PING', True),
+    }
+    statement_timeout = env_int('DB_STATEMENT_TIMEOUT_MS', 0)
+    if statement_timeout:
+        if url.startswith('postgresql'):
+            options["connect_args"] = {"options": "-c statement_timeout=%d" % statement_timeout}
+        elif url.startswith('mysql'):
+            options["connect_args"] = {"init_command": "SET SESSION max_execution_time=%d" % statement_timeout}
+    return options
+
+def sqlite_pragmas():
+    if not env_bool('SQLITE_TUNED', True):
+        return []
+    return [
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA mmap_size=%d" % env_int('SQLITE_MMAP_SIZE', 268435456),
+        "PRAGMA busy_timeout=%d" % env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+    ]
+
+def configure_database(app):
+    """Fills the SQLALCHEMY_* config, call it before db.init_app(app)"""
+    url = database_url()
+    app.config.setdefault('SQLALCHEMY_DATABASE_URI', url)
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(app.config['SQLALCHEMY_DATABASE_URI']))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+def tune_sqlite(engine):
+    """WAL lets readers in other gunicorn workers run while one writes"""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
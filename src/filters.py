@@ -0,0 +1,62 @@
+"""
+Query string filters and sorting for the catalog collections, pushed down into SQL.
+
+    ?climate=arid                 equality on any text field
+    ?population_gt=1000000        _gt / _gte / _lt / _lte on numeric fields
+    ?sort=-diameter               id, name or a numeric field, '-' for descending
+
+Numeric filters and sorts use the indexed *_num shadow columns. Rows whose value is
+unknown (no number could be parsed) never match a numeric filter and sort last.
+"""
+from utils import APIException
+
+# query params that are not filters
+RESERVED = ('fields', 'limit', 'after', 'sort', 'format')
+
+OPERATORS = {
+    '_gte': lambda column, value: column >= value,
+    '_lte': lambda column, value: column <= value,
+    '_gt': lambda column, value: column > value,
+    '_lt': lambda column, value: column < value,
+}
+
+def split_operator(name):
+    for suffix, operator in OPERATORS.items():
+        if name.endswith(suffix):
+            return name[:-len(suffix)], operator
+    return name, None
+
+def parse_float(name, raw):
+    try:
+        return float(raw)
+    except ValueError:
+        raise APIException('%s must be a number' % name, status_code=400)
+
+def filter_conditions(model, args):
+    conditions = []
+    for name, raw in args.items(multi=True):
+        if name in RESERVED:
+            continue
+        field, operator = split_operator(name)
+        if operator is not None and field in model.numeric_fields:
+            conditions.append(operator(getattr(model, field + '_num'), parse_float(name, raw)))
+        elif operator is None and field in model.serialize_fields:
+            conditions.append(getattr(model, field) == (parse_float(name, raw) if field == 'id' else raw))
+        else:
+            raise APIException('Unknown filter: %s' % name, status_code=400)
+    return conditions
+
+def sort_column(model, raw):
+    """?sort= -> (spec, column, descending), spec is None for the default id order"""
+    if not raw or raw == 'id':
+        return None, model.id, False
+    descending = raw.startswith('-')
+    field = raw.lstrip('-')
+    if field == 'id':
+        return raw, model.id, descending
+    if field == 'name':
+        return raw, model.name, descending
+    if field in model.numeric_fields:
+        return raw, getattr(model, field + '_num'), descending
+    # only indexed columns, anything else would sort the whole table
+    raise APIException('Cannot sort by %s' % field, status_code=400)
@@ -0,0 +1,50 @@
+"""
+Response representations picked from the Accept header:
+
+- application/json (default): a list of objects, as always
+- application/vnd.starwars.columnar+json: {"columns": [...], "rows": [[...], ...]}, keys sent once
+- application/msgpack: the default shape in MessagePack, when msgpack is installed
+
+Only lists of rows change shape; single objects and errors stay plain JSON.
+"""
+from flask import current_app, request
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+JSON = 'application/json'
+COLUMNAR = 'application/vnd.starwars.columnar+json'
+MSGPACK = 'application/msgpack'
+
+# first entry wins ties, so */* and missing Accept headers get JSON
+MIMETYPES = {JSON: 'json', COLUMNAR: 'columnar'}
+if msgpack is not None:
+    MIMETYPES.update({MSGPACK: 'msgpack', 'application/x-msgpack': 'msgpack'})
+CONTENT_TYPES = {'json': JSON, 'columnar': COLUMNAR, 'msgpack': MSGPACK}
+
+def negotiate(accept):
+    """'json', 'columnar' or 'msgpack' for an Accept header value"""
+    if not accept:
+        return 'json'
+    best = parse_accept_header(accept, MIMEAccept).best_match(list(MIMETYPES))
+    return MIMETYPES.get(best, 'json')
+
+def negotiated_format():
+    return negotiate(request.headers.get('Accept'))
+
+def columnar(rows):
+    keys = list(rows[0]) if rows else []
+    return {"columns": keys, "rows": [[row.get(key) for key in keys] for row in rows]}
+
+def encode(payload, representation):
+    """(body bytes, mimetype) for `payload` in the requested representation"""
+    is_rows = isinstance(payload, list) and all(isinstance(row, dict) for row in payload)
+    if representation == 'msgpack' and is_rows:
+        return msgpack.packb(payload), MSGPACK
+    if representation == 'columnar' and is_rows:
+        return current_app.json.dumps(columnar(payload)).encode(), COLUMNAR
+    return current_app.json.dumps(payload).encode(), JSON
@@ -0,0 +1,231 @@
+"""
+Background jobs for writes too slow for a request: cascading deletes and bulk imports.
+
+Jobs are rows in the jobs table, so they survive restarts and any process can run
+them. A worker claims a job with a conditional UPDATE, only one worker sees it
+succeed, runs the handler and stores the result. A failing job is queued again with
+exponential backoff until max_attempts. A job whose worker died is claimed again once
+its lease (JOBS_LEASE_SECONDS) runs out, so handlers must be safe to run twice.
+
+JOBS_WORKERS threads start with the first request of every web process. Set it to 0
+and run `flask run-jobs` as its own process to keep jobs off the API workers.
+
+Periodic jobs (PERIODIC_JOBS) queue their next run when they finish, the workers
+queue the first one when they start.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, or_
+from bulk import bulk_create, bulk_delete
+from cache import invalidate
+from popularity import reconcile_all
+from models import db, Job, User, CATALOG, utcnow
+
+HANDLERS = {}
+MAX_BACKOFF_SECONDS = 300
+# kind -> config key holding the seconds between runs, 0 turns the job off
+PERIODIC_JOBS = {'reconcile_popularity': 'POPULARITY_RECONCILE_SECONDS'}
+
+def job_handler(kind):
+    """Registers `function(session, job, payload)` for jobs of `kind`, its return value is the job result"""
+    def decorator(function):
+        HANDLERS[kind] = function
+        return function
+    return decorator
+
+def enqueue(session, kind, payload, max_attempts=None, run_at=None):
+    job = Job(kind=kind, payload=json.dumps(payload), run_at=run_at or utcnow(),
+              max_attempts=max_attempts or current_app.config['JOBS_MAX_ATTEMPTS'])
+    session.add(job)
+    session.commit()
+    current_app.extensions['jobs'].wake()
+    return job
+
+def schedule_periodic(session, kind):
+    """Queues the next run of a periodic job unless one is already waiting"""
+    interval = current_app.config[PERIODIC_JOBS[kind]]
+    if not interval:
+        return None
+    if session.query(Job.id).filter(Job.kind == kind, Job.status.in_(('queued', 'running'))).first() is not None:
+        return None
+    return enqueue(session, kind, {}, run_at=utcnow() + timedelta(seconds=interval))
+
+def report_progress(session, job, done, total=None):
+    """Commits the session, call it between chunks. Also renews the lease."""
+    job.progress = done
+    if total is not None:
+        job.total = total
+    job.locked_at = utcnow()
+    session.commit()
+
+def claim(session, worker_id, lease):
+    """The oldest runnable job, now marked running for `worker_id`, or None"""
+    now = utcnow()
+    runnable = or_(and_(Job.status == 'queued', Job.run_at <= now),
+                   and_(Job.status == 'running', Job.locked_at < now - timedelta(seconds=lease)))
+    candidates = session.query(Job.id, Job.status, Job.locked_at).filter(runnable) \
+        .order_by(Job.run_at, Job.id).limit(5).all()
+    for job_id, status, locked_at in candidates:
+        # another worker may have taken it since the SELECT, only one UPDATE matches
+        claimed = session.query(Job).filter(Job.id == job_id, Job.status == status, Job.locked_at == locked_at) \
+            .update({Job.status: 'running', Job.locked_by: worker_id, Job.locked_at: now,
+                     Job.attempts: Job.attempts + 1, Job.updated_at: now}, synchronize_session=False)
+        session.commit()
+        if claimed:
+            return session.get(Job, job_id)
+    return None
+
+def run_job(session, job):
+    handler = HANDLERS.get(job.kind)
+    try:
+        if handler is None:
+            raise ValueError('Unknown job kind %r' % job.kind)
+        if job.attempts > job.max_attempts:
+            # claimed again after its worker died mid-run too many times
+            raise RuntimeError('Worker lost %d times' % job.max_attempts)
+        result = handler(session, job, json.loads(job.payload))
+    except Exception as error:
+        session.rollback()
+        current_app.logger.exception('job %s (%s) failed', job.id, job.kind)
+        job.error = '%s: %s' % (type(error).__name__, error)
+        if job.attempts < job.max_attempts:
+            job.status = 'queued'
+            job.run_at = utcnow() + timedelta(seconds=min(MAX_BACKOFF_SECONDS, 2 ** job.attempts))
+        else:
+            job.status = 'failed'
+    else:
+        job.status = 'done'
+        job.result = json.dumps(result)
+        job.error = None
+        if job.total is not None:
+            job.progress = job.total
+    job.locked_by = job.locked_at = None
+    session.commit()
+    if job.kind in PERIODIC_JOBS and job.status != 'queued':
+        schedule_periodic(session, job.kind)
+
+class JobWorkers:
+    """Threads claiming and running jobs for one app"""
+
+    def __init__(self, app, threads=1, poll_interval=1.0, lease=300):
+        self.app = app
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.started = False
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self.started:
+                return
+            self.started = True
+        with self.app.app_context():
+            for kind in PERIODIC_JOBS:
+                schedule_periodic(db.session, kind)
+        for number in range(self.threads):
+            threading.Thread(target=self.loop, name='job-worker-%d' % number, daemon=True).start()
+
+    def wake(self):
+        """Skips the poll interval, enqueue() calls it so same-process jobs start right away"""
+        self._wake.set()
+
+    def run_once(self):
+        """Runs one job, False when none was runnable"""
+        # pid is read here, not in __init__, a forked server worker has its own
+        worker_id = '%s:%d:%s' % (socket.gethostname(), os.getpid(), threading.current_thread().name)
+        with self.app.app_context():
+            job = claim(db.session, worker_id, self.lease)
+            if job is None:
+                return False
+            run_job(db.session, job)
+            return True
+
+    def loop(self):
+        while True:
+            try:
+                ran = self.run_once()
+            except Exception:
+                self.app.logger.exception('job worker error')
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+def start_workers():
+    workers = current_app.extensions['jobs']
+    if not workers.started:
+        workers.start()
+
+@job_handler('bulk_create')
+def run_bulk_create(session, job, payload):
+    report_progress(session, job, 0, len(payload['items']))
+    results = bulk_create(session, CATALOG[payload['resource']], payload['items'])
+    invalidate(payload['resource'])
+    return results
+
+@job_handler('delete')
+def run_delete(session, job, payload):
+    """
+    Deletes catalog rows or users and every favorite pointing at them, chunk by chunk.
+    Until it finishes, the job result holds what the committed chunks deleted.
+    """
+    resource = payload['resource']
+    model = User if resource == 'user' else CATALOG[resource]
+    resumed = json.loads(job.result) if job.result is not None else None
+
+    def checkpoint(state):
+        job.result = json.dumps(state)
+
+    results = bulk_delete(session, model, payload['ids'], lambda done, total: report_progress(session, job, done, total),
+                          resumed=resumed, checkpoint=checkpoint)
+    if model is not User:
+        invalidate(resource)
+    return results
+
+@job_handler('reconcile_popularity')
+def run_reconcile_popularity(session, job, payload):
+    return {"corrected": reconcile_all(session)}
+
+@click.command('run-jobs')
+@click.option('--threads', default=1, show_default=True, help='Worker threads.')
+@click.option('--drain', is_flag=True, help='Exit once no job is runnable instead of polling.')
+@with_appcontext
+def run_jobs_command(threads, drain):
+    """Runs queued jobs in the foreground"""
+    workers = current_app.extensions['jobs']
+    if drain:
+        ran = 0
+        while workers.run_once():
+            ran += 1
+        click.echo('ran %d jobs' % ran)
+        return
+    workers.threads = threads
+    workers.start()
+    while True:
+        time.sleep(60)
+
+def init_jobs(app):
+    app.config.setdefault('JOBS_WORKERS', int(os.environ.get('JOBS_WORKERS', 1)))
+    app.config.setdefault('JOBS_POLL_INTERVAL', float(os.environ.get('JOBS_POLL_INTERVAL', 1.0)))
+    app.config.setdefault('JOBS_LEASE_SECONDS', int(os.environ.get('JOBS_LEASE_SECONDS', 300)))
+    app.config.setdefault('JOBS_MAX_ATTEMPTS', int(os.environ.get('JOBS_MAX_ATTEMPTS', 3)))
+    app.config.setdefault('POPULARITY_RECONCILE_SECONDS', int(os.environ.get('POPULARITY_RECONCILE_SECONDS', 3600)))
+    app.extensions['jobs'] = JobWorkers(
+        app,
+        threads=app.config['JOBS_WORKERS'],
+        poll_interval=app.config['JOBS_POLL_INTERVAL'],
+        lease=app.config['JOBS_LEASE_SECONDS'],
+    )
+    # not at startup: CLI commands such as `flask db upgrade` build the app too
+    if app.config['JOBS_WORKERS']:
+        app.before_request(start_workers)
+    return app.extensions['jobs']
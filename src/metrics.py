@@ -0,0 +1,176 @@
+"""
+Per-route request metrics: latency, SQL query count / time, serialization time
+and response size, exposed in Prometheus text format at /metrics.
+Send `X-Debug-Timing: 1` (or set METRICS_SERVER_TIMING) to get a Server-Timing header back.
+Counters live in the worker process, scrape each gunicorn worker separately.
+The native handlers in asgi.py record into the same series through a Sample.
+"""
+import contextvars
+import os
+import threading
+import time
+from flask import Response, current_app, g, request, has_request_context
+from sqlalchemy import event
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+class Histogram:
+
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series["buckets"][index] += 1
+        series["sum"] += value
+        series["count"] += 1
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s histogram' % self.name]
+        for labels, series in sorted(self.series.items()):
+            for bound, count in zip(self.buckets, series["buckets"]):
+                lines.append('%s_bucket{%s} %d' % (self.name, format_labels(labels + (('le', format_number(bound)),)), count))
+            lines.append('%s_bucket{%s} %d' % (self.name, format_labels(labels + (('le', '+Inf'),)), series["count"]))
+            lines.append('%s_sum{%s} %s' % (self.name, format_labels(labels), format_number(series["sum"])))
+            lines.append('%s_count{%s} %d' % (self.name, format_labels(labels), series["count"]))
+        return lines
+
+class Counter:
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s counter' % self.name]
+        for labels, value in sorted(self.series.items()):
+            lines.append('%s{%s} %s' % (self.name, format_labels(labels), format_number(value)))
+        return lines
+
+def format_labels(labels):
+    return ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"')) for key, value in labels)
+
+def format_number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metrics:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter('http_requests_total', 'Requests by route, method and status')
+        self.latency = Histogram('http_request_duration_seconds', 'Request latency', LATENCY_BUCKETS)
+        self.queries = Histogram('db_queries_per_request', 'SQL statements executed per request', QUERY_BUCKETS)
+        self.sql_time = Counter('db_query_duration_seconds_total', 'Time spent in SQL statements')
+        self.serialize_time = Counter('serialization_duration_seconds_total', 'Time spent encoding JSON')
+        self.size = Histogram('http_response_size_bytes', 'Response body size', SIZE_BUCKETS)
+
+    def record(self, route, method, status, duration, queries, sql_time, serialize_time, size):
+        labels = (('route', route), ('method', method))
+        with self.lock:
+            self.requests.inc(labels + (('status', status),))
+            self.latency.observe(labels, duration)
+            self.queries.observe(labels, queries)
+            self.sql_time.inc(labels, sql_time)
+            self.serialize_time.inc(labels, serialize_time)
+            if size is not None:
+                self.size.observe(labels, size)
+
+    def render(self):
+        with self.lock:
+            lines = []
+            for metric in (self.requests, self.latency, self.queries, self.sql_time, self.serialize_time, self.size):
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+class Sample:
+    """Query count and timings of one request served outside Flask, what g holds on the Flask side"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serialize_time = 0.0
+
+# the Sample of the request running in this task, the cursor hooks and timed_dumps add to it
+current_sample = contextvars.ContextVar('metrics_sample', default=None)
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_queries += 1
+        g.metrics_sql_time += elapsed
+    sample = current_sample.get()
+    if sample is not None:
+        sample.queries += 1
+        sample.sql_time += elapsed
+
+def listen_queries(engine):
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+def timed_dumps(dumps):
+    def wrapper(obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return dumps(obj, **kwargs)
+        finally:
+            if has_request_context() and 'metrics_start' in g:
+                g.metrics_serialize_time += time.perf_counter() - start
+            sample = current_sample.get()
+            if sample is not None:
+                sample.serialize_time += time.perf_counter() - start
+    return wrapper
+
+def server_timing(duration, queries, sql_time, serialize_time):
+    return 'app;dur=%.2f, db;dur=%.2f;desc="%d queries", serialize;dur=%.2f' % (
+        duration * 1000, sql_time * 1000, queries, serialize_time * 1000)
+
+def init_metrics(app, engine):
+    app.config.setdefault('METRICS_SERVER_TIMING', os.environ.get('METRICS_SERVER_TIMING', '0') == '1')
+    metrics = app.extensions['metrics'] = Metrics()
+
+    listen_queries(engine)
+    # jsonify() and the cache both encode through app.json
+    app.json.dumps = timed_dumps(app.json.dumps)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        g.metrics_queries = 0
+        g.metrics_sql_time = 0.0
+        g.metrics_serialize_time = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'metrics_start' not in g:
+            return response
+        duration = time.perf_counter() - g.metrics_start
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        # streamed bodies have no length yet
+        size = None if response.is_streamed else response.calculate_content_length()
+        metrics.record(route, request.method, response.status_code, duration,
+                       g.metrics_queries, g.metrics_sql_time, g.metrics_serialize_time, size)
+        if app.config['METRICS_SERVER_TIMING'] or request.headers.get('X-Debug-Timing') == '1':
+            response.headers['Server-Timing'] = server_timing(duration, g.metrics_queries, g.metrics_sql_time, g.metrics_serialize_time)
+        return response
+
+    return metrics
+
+def metrics_response():
+    return Response(current_app.extensions['metrics'].render(), mimetype='text/plain; version=0.0.4')
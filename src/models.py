@@ -1,14 +1,51 @@
+import json
+import re
+from datetime import datetime, timezone
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, event, inspect, text
+from sqlalchemy.orm import Session
 
 db = SQLAlchemy()
 
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+def parse_number(value):
+    """'1,000,000' -> 1000000.0, '30-165' -> 30.0, 'unknown' -> None"""
+    if value is None:
+        return None
+    match = NUMBER_RE.match(str(value).replace(',', '').strip())
+    return float(match.group()) if match else None
+
+def numeric_shadow(source):
+    """
+    Indexed Float copy of a String column so range filters and sorting run in SQL.
+    Filled on insert (ORM and Core executemany alike), sync_numeric_columns keeps it current on update.
+    """
+    def default(context):
+        return parse_number(context.get_current_parameters().get(source))
+    return db.Column(db.Float, nullable=True, index=True, default=default, info={"shadow_of": source})
+
+def favorites_counter():
+    """
+    Number of favorites pointing at the row, kept current by track_table_writes and
+    the Core writes in bulk.py, and corrected by popularity.reconcile_counts.
+    """
+    return db.Column(db.Integer, nullable=False, default=0, server_default='0', info={"counter_of": "favorites"})
+
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     username = db.Column(db.String(50), unique=True)
     email = db.Column(db.String(50), unique=True, nullable=False)
-    password = db.Column(db.String(50), unique=False, nullable=False)
+    # scrypt$n$r$p$salt$hash, see passwords.py
+    password = db.Column(db.String(255), unique=False, nullable=False)
     is_active = db.Column(db.Boolean(), unique=False, nullable=True, default=True)
 
+    # columns returned by serialize(), in the same order
+    serialize_fields = ("id", "username", "email")
+
     def __repr__(self):
         return '<User %r>' % self.username
 
@@ -23,13 +60,25 @@ class User(db.Model):
 class Favorites(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=True)
-    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True)
-    starship_id = db.Column(db.Integer, db.ForeignKey('starships.id'), nullable=True)
+    character_id = db.Column(db.Integer, db.ForeignKey('characters.id'), nullable=True, index=True)
+    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), nullable=True, index=True)
+    starship_id = db.Column(db.Integer, db.ForeignKey('starships.id'), nullable=True, index=True)
     user = db.relationship('User', backref='favorites')
     character = db.relationship('Characters', backref='favorites')
     planet = db.relationship('Planets', backref='favorites')
     starship = db.relationship('Starships', backref='favorites')
+
+    serialize_fields = ("id", "user_id", "character_id", "planet_id", "starship_id")
+    serialize_aliases = {"id": "favorite_id"}
+
+    # NULLs never collide, so each index only constrains its own kind of favorite.
+    # user_id leads every index, lookups by user alone use them too.
+    # The catalog ids have their own indexes (index=True) for cascading deletes.
+    __table_args__ = (
+        db.Index('uq_favorites_user_character', 'user_id', 'character_id', unique=True),
+        db.Index('uq_favorites_user_planet', 'user_id', 'planet_id', unique=True),
+        db.Index('uq_favorites_user_starship', 'user_id', 'starship_id', unique=True),
+    )
  
     def __repr__(self):
         return '<Favorites %r>' % self.id
@@ -43,6 +92,14 @@ class Favorites(db.Model):
             "starship_id": self.starship_id        
         }
 
+    def serialize_expanded(self):
+        # load the relationships up front (selectinload) or this lazy-loads one query per row
+        rv = self.serialize()
+        rv["character"] = self.character.serialize() if self.character else None
+        rv["planet"] = self.planet.serialize() if self.planet else None
+        rv["starship"] = self.starship.serialize() if self.starship else None
+        return rv
+
 class Characters(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
@@ -53,8 +110,17 @@ class Characters(db.Model):
     eye_color = db.Column(db.String(50), unique=False, nullable=False)
     birth_year = db.Column(db.String(50), unique=False, nullable=False)
     gender = db.Column(db.String(50), unique=False, nullable=False)
-    
-    
+
+    height_num = numeric_shadow('height')
+    mass_num = numeric_shadow('mass')
+    favorites_count = favorites_counter()
+
+    # GET /stats/popular walks this index backwards
+    __table_args__ = (db.Index('ix_characters_popularity', 'favorites_count', 'id'),)
+
+    numeric_fields = ("height", "mass")
+    serialize_fields = ("id", "name", "height", "mass", "hair_color", "skin_color", "eye_color", "birth_year", "gender")
+
     def __repr__(self):
         return '<Characters %r>' % self.name
 
@@ -82,7 +148,19 @@ class Planets(db.Model):
     climate = db.Column(db.String(50), unique=False, nullable=False)
     terrain = db.Column(db.String(50), unique=False, nullable=False)
     surface_water = db.Column(db.String(50), unique=False, nullable=False)
-    
+
+    diameter_num = numeric_shadow('diameter')
+    rotation_period_num = numeric_shadow('rotation_period')
+    orbital_period_num = numeric_shadow('orbital_period')
+    population_num = numeric_shadow('population')
+    surface_water_num = numeric_shadow('surface_water')
+    favorites_count = favorites_counter()
+
+    __table_args__ = (db.Index('ix_planets_popularity', 'favorites_count', 'id'),)
+
+    numeric_fields = ("diameter", "rotation_period", "orbital_period", "population", "surface_water")
+    serialize_fields = ("id", "name", "diameter", "rotation_period", "orbital_period", "gravity", "population", "climate", "terrain", "surface_water")
+
     def __repr__(self):
         return '<Planets %r>' % self.name
 
@@ -116,6 +194,23 @@ class Starships(db.Model):
     cargo_capacity = db.Column(db.String(50), unique=False, nullable=False)
     consumables = db.Column(db.String(50), unique=False, nullable=False)
 
+    cost_in_credits_num = numeric_shadow('cost_in_credits')
+    length_num = numeric_shadow('length')
+    crew_num = numeric_shadow('crew')
+    passengers_num = numeric_shadow('passengers')
+    max_atmosphering_speed_num = numeric_shadow('max_atmosphering_speed')
+    hyperdrive_rating_num = numeric_shadow('hyperdrive_rating')
+    MGLT_num = numeric_shadow('MGLT')
+    cargo_capacity_num = numeric_shadow('cargo_capacity')
+    favorites_count = favorites_counter()
+
+    __table_args__ = (db.Index('ix_starships_popularity', 'favorites_count', 'id'),)
+
+    numeric_fields = ("cost_in_credits", "length", "crew", "passengers", "max_atmosphering_speed", "hyperdrive_rating", "MGLT", "cargo_capacity")
+    serialize_fields = ("id", "name", "model", "starship_class", "manufacturer", "cost_in_credits", "length", "crew", "passengers", "max_atmosphering_speed", "hyperdrive_rating", "MGLT", "cargo_capacity", "consumables")
+    # serialize() publishes some columns under a different key
+    serialize_aliases = {"hyperdrive_rating": "hyperdrive_ratin"}
+
     def __repr__(self):
         return '<Starships %r>' % self.name
 
@@ -135,4 +230,230 @@ class Starships(db.Model):
             "MGLT": self.MGLT,
             "cargo_capacity": self.cargo_capacity,
             "consumables": self.consumables
-        }
\ No newline at end of file
+        }
+class TableVersion(db.Model):
+    """One row per tracked table, bumped on every write so GET handlers can answer 304s cheaply"""
+    __tablename__ = 'table_versions'
+    table_name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    def __repr__(self):
+        return '<TableVersion %r %r>' % (self.table_name, self.version)
+
+VERSIONED_TABLES = ('user', 'characters', 'planets', 'starships', 'favorites')
+
+class Change(db.Model):
+    """Append-only log of catalog and favorites writes, read by GET /changes (see changes.py)"""
+    __tablename__ = 'changes'
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    resource = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    # insert, update or delete; deletes are the tombstones clients sync removals from
+    op = db.Column(db.String(10), nullable=False)
+    # owner of a favorite, so a client can follow only its own list
+    user_id = db.Column(db.Integer, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+
+    # compaction looks up the newest entry per entity
+    __table_args__ = (
+        db.Index('ix_changes_resource_entity', 'resource', 'entity_id', 'seq'),
+    )
+
+    def __repr__(self):
+        return '<Change %r %s %s %r>' % (self.seq, self.op, self.resource, self.entity_id)
+
+CHANGE_TABLES = ('characters', 'planets', 'starships', 'favorites')
+
+class Job(db.Model):
+    """Background work queued by the API and run by jobs.py workers, reported by GET /jobs/<id>"""
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    kind = db.Column(db.String(50), nullable=False)
+    # JSON arguments and outcome
+    payload = db.Column(db.Text, nullable=False)
+    result = db.Column(db.Text, nullable=True)
+    # queued -> running -> done | failed, back to queued while retries are left
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    progress = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    # not picked up before this time, retries back off through it
+    run_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=utcnow, onupdate=utcnow)
+
+    # workers look for the oldest runnable job
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return '<Job %r %s %s>' % (self.id, self.kind, self.status)
+
+    def serialize(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "progress": self.progress,
+            "total": self.total,
+            "result": json.loads(self.result) if self.result is not None else None,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() + 'Z',
+            "updated_at": self.updated_at.isoformat() + 'Z',
+        }
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def seed_table_versions(table, connection, **kw):
+    now = utcnow()
+    connection.execute(table.insert(), [{"table_name": name, "version": 0, "updated_at": now} for name in VERSIONED_TABLES])
+
+# catalog_search, the SQLite full text index behind /search (search.py)
+# rowid = id * 4 + code keeps one rowid per entity, so triggers delete by rowid instead of scanning
+RESOURCE_CODES = {"characters": 1, "planets": 2, "starships": 3}
+DESCRIPTIVE_COLUMNS = {
+    "characters": ("gender", "hair_color", "skin_color", "eye_color"),
+    "planets": ("climate", "terrain"),
+    "starships": ("model", "starship_class", "manufacturer"),
+}
+
+def body_sql(resource, prefix):
+    return " || ' ' || ".join('%s.%s' % (prefix, column) for column in DESCRIPTIVE_COLUMNS[resource])
+
+def search_index_ddl():
+    statements = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS catalog_search USING fts5("
+        "resource UNINDEXED, entity_id UNINDEXED, name, body, tokenize='unicode61 remove_diacritics 2')"
+    ]
+    for resource, code in RESOURCE_CODES.items():
+        insert = ("INSERT INTO catalog_search(rowid, resource, entity_id, name, body) "
+                  "VALUES (new.id * 4 + {code}, '{resource}', new.id, new.name, {body});").format(
+                      code=code, resource=resource, body=body_sql(resource, 'new'))
+        delete = "DELETE FROM catalog_search WHERE rowid = old.id * 4 + {code};".format(code=code)
+        statements += [
+            "CREATE TRIGGER IF NOT EXISTS {0}_search_insert AFTER INSERT ON {0} BEGIN {1} END".format(resource, insert),
+            "CREATE TRIGGER IF NOT EXISTS {0}_search_delete AFTER DELETE ON {0} BEGIN {1} END".format(resource, delete),
+            # only the indexed columns, counter updates (favorites_count) must not rewrite the index
+            "CREATE TRIGGER IF NOT EXISTS {0}_search_update AFTER UPDATE OF {1} ON {0} BEGIN {2} {3} END".format(
+                resource, ', '.join(('name',) + DESCRIPTIVE_COLUMNS[resource]), delete, insert),
+        ]
+    return statements
+
+def backfill_sql(resource):
+    return ("INSERT INTO catalog_search(rowid, resource, entity_id, name, body) "
+            "SELECT id * 4 + {code}, '{resource}', id, name, {body} FROM {resource}").format(
+                code=RESOURCE_CODES[resource], resource=resource, body=body_sql(resource, resource))
+
+# on the metadata, not on one table: every create_all() builds or backfills it
+@event.listens_for(db.metadata, 'after_create')
+def create_search_index(target, connection, **kw):
+    if connection.dialect.name != 'sqlite':
+        return
+    exists = connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'catalog_search'")).first()
+    for statement in search_index_ddl():
+        connection.execute(text(statement))
+    if not exists:
+        # rows written before the index existed
+        for resource in RESOURCE_CODES:
+            connection.execute(text(backfill_sql(resource)))
+
+def bump_table_versions(connection, table_names):
+    """Increments the version of every table in `table_names`, call it inside the writing transaction"""
+    table = TableVersion.__table__
+    now = utcnow()
+    for name in sorted(set(table_names)):
+        result = connection.execute(
+            table.update().where(table.c.table_name == name).values(version=table.c.version + 1, updated_at=now)
+        )
+        if result.rowcount == 0:
+            connection.execute(table.insert().values(table_name=name, version=1, updated_at=now))
+
+def record_changes(connection, changes):
+    """Appends (resource, entity_id, op, user_id) tuples to the change log, call it inside the writing transaction"""
+    now = utcnow()
+    rows = [{"resource": resource, "entity_id": entity_id, "op": op, "user_id": user_id, "created_at": now}
+            for resource, entity_id, op, user_id in changes]
+    if rows:
+        connection.execute(Change.__table__.insert(), rows)
+
+def adjust_favorite_counts(connection, deltas):
+    """Applies {(catalog table, id): delta} to the favorites_count columns, call it inside the writing transaction"""
+    by_table = {}
+    # a fixed order keeps concurrent writers from locking the same rows in opposite orders
+    for (table_name, entity_id), delta in sorted(deltas.items()):
+        if delta:
+            by_table.setdefault(table_name, []).append({"row_id": entity_id, "delta": delta})
+    for table_name, rows in by_table.items():
+        table = CATALOG[table_name].__table__
+        connection.execute(table.update().where(table.c.id == bindparam('row_id'))
+                           .values(favorites_count=table.c.favorites_count + bindparam('delta')), rows)
+
+def count_favorites(deltas, favorite, sign):
+    """Adds `sign` to the count of whatever `favorite` (an object or a row) points at"""
+    for table_name, column in FAVORITE_COLUMNS.items():
+        entity_id = getattr(favorite, column)
+        if entity_id is not None:
+            deltas[(table_name, entity_id)] = deltas.get((table_name, entity_id), 0) + sign
+
+def favorite_count_deltas(written):
+    deltas = {}
+    for obj, op in written:
+        if not isinstance(obj, Favorites):
+            continue
+        if op == 'insert':
+            count_favorites(deltas, obj, 1)
+        elif op == 'delete':
+            count_favorites(deltas, obj, -1)
+        else:
+            # a favorite repointed in the admin, or cleared when its target was deleted
+            state = inspect(obj)
+            for table_name, column in FAVORITE_COLUMNS.items():
+                history = state.attrs[column].history
+                for entity_id in history.deleted or ():
+                    if entity_id is not None:
+                        deltas[(table_name, entity_id)] = deltas.get((table_name, entity_id), 0) - 1
+                for entity_id in history.added or ():
+                    if entity_id is not None:
+                        deltas[(table_name, entity_id)] = deltas.get((table_name, entity_id), 0) + 1
+    return deltas
+
+@event.listens_for(Session, 'after_flush')
+def track_table_writes(session, flush_context):
+    # new/dirty/deleted still describe what this flush wrote
+    written = [(obj, 'insert') for obj in session.new] + [(obj, 'delete') for obj in session.deleted]
+    written += [(obj, 'update') for obj in session.dirty if session.is_modified(obj, include_collections=False)]
+    tables = set(obj.__table__.name for obj, _ in written) & set(VERSIONED_TABLES)
+    if not tables:
+        return
+    connection = session.connection()
+    bump_table_versions(connection, tables)
+    adjust_favorite_counts(connection, favorite_count_deltas(written))
+    record_changes(connection, [(obj.__table__.name, obj.id, op, getattr(obj, 'user_id', None))
+                                for obj, op in written if obj.__table__.name in CHANGE_TABLES])
+
+def sync_numeric_columns(mapper, connection, target):
+    for field in target.numeric_fields:
+        setattr(target, field + '_num', parse_number(getattr(target, field)))
+
+for catalog_model in (Characters, Planets, Starships):
+    event.listen(catalog_model, 'before_update', sync_numeric_columns)
+
+# url name -> model for the catalog collections
+CATALOG = {
+    "characters": Characters,
+    "planets": Planets,
+    "starships": Starships,
+}
+
+# catalog table -> Favorites column that references it
+FAVORITE_COLUMNS = {
+    "characters": "character_id",
+    "planets": "planet_id",
+    "starships": "starship_id",
+}
@@ -0,0 +1,126 @@
+"""
+Keyset (cursor) pagination and column projection for the collection endpoints,
+see filters.py for the ?sort= and filter params
+"""
+import base64
+import json
+from urllib.parse import urlencode
+from flask import request
+from sqlalchemy import and_, or_, select
+from utils import APIException
+from filters import filter_conditions, sort_column
+from serializers import SERIALIZED_COLUMNS, columns_for, keys_for, rows_to_dicts
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def parse_fields(model, raw):
+    """Turns ?fields=a,b,c into the list of (key, column) pairs to select, id is always included"""
+    columns = SERIALIZED_COLUMNS[model]
+    if not raw:
+        return columns
+    wanted = set(name.strip() for name in raw.split(',') if name.strip())
+    known = set(key for key, _ in columns) | set(name for _, name in columns)
+    unknown = sorted(wanted - known)
+    if unknown:
+        raise APIException('Unknown fields: ' + ', '.join(unknown), status_code=400)
+    return [(key, name) for key, name in columns if name == 'id' or key in wanted or name in wanted]
+
+def parse_limit(raw):
+    if raw is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(raw)
+    except ValueError:
+        raise APIException('limit must be an integer', status_code=400)
+    if limit < 1:
+        raise APIException('limit must be greater than zero', status_code=400)
+    return min(limit, MAX_PAGE_SIZE)
+
+def encode_cursor(last_id, sort=None, value=None):
+    position = {"id": last_id}
+    if sort is not None:
+        position.update(s=sort, v=value)
+    raw = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, sort=None):
+    """Returns the position stored in `cursor`, it must have been issued for the same sort"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = position["id"]
+    except (ValueError, KeyError, TypeError):
+        raise APIException('Invalid cursor', status_code=400)
+    if not isinstance(last_id, int) or position.get("s") != sort:
+        raise APIException('Invalid cursor', status_code=400)
+    return position
+
+def keyset_condition(model, column, descending, position):
+    """Rows after `position` in the order page_statement() sorts by, NULL values last"""
+    last_id, value = position["id"], position.get("v")
+    after_id = model.id < last_id if descending else model.id > last_id
+    if column is model.id:
+        return after_id
+    if value is None:
+        # the cursor is already in the NULL tail, only ids are left to compare
+        return and_(column.is_(None), after_id)
+    after_value = column < value if descending else column > value
+    condition = or_(after_value, and_(column == value, after_id))
+    if column.expression.nullable:
+        condition = or_(condition, column.is_(None))
+    return condition
+
+def page_statement(model, args):
+    """
+    Builds the SELECT for one page of `model`, filtered and ordered by ?sort= (id by default)
+    with id as tie breaker. Returns (statement, fields, limit, sort) for page_results().
+    Only the projected columns are selected so no ORM instances are built.
+    """
+    fields = parse_fields(model, args.get('fields'))
+    limit = parse_limit(args.get('limit'))
+    sort, column, descending = sort_column(model, args.get('sort'))
+    position = decode_cursor(args.get('after'), sort)
+
+    statement = select(*columns_for(model, fields), column.label('sort_value'))
+    statement = statement.where(*filter_conditions(model, args))
+    if position is not None:
+        statement = statement.where(keyset_condition(model, column, descending, position))
+    if column is not model.id and column.expression.nullable:
+        # rows without a value ("unknown", "n/a") come last in either direction instead of being dropped
+        statement = statement.order_by(column.is_(None))
+    if descending:
+        statement = statement.order_by(column.desc(), model.id.desc())
+    else:
+        statement = statement.order_by(column, model.id)
+    # one extra row tells us whether there is a next page without a COUNT
+    return statement.limit(limit + 1), fields, limit, sort
+
+def page_results(model, rows, fields, limit, sort):
+    """(results, next_cursor) from the rows page_statement() returned"""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].id, sort, rows[-1].sort_value)
+    return rows_to_dicts(keys_for(model, fields), rows), next_cursor
+
+def keyset_page(session, model, args=None):
+    """Returns (results, next_cursor) for the page of `model` described by the query string"""
+    args = request.args if args is None else args
+    statement, fields, limit, sort = page_statement(model, args)
+    return page_results(model, session.execute(statement).all(), fields, limit, sort)
+
+def next_page_headers(base_url, args, next_cursor):
+    if next_cursor is None:
+        return {}
+    args = dict(args, after=next_cursor)
+    return {
+        'Link': '<%s?%s>; rel="next"' % (base_url, urlencode(args)),
+        'X-Next-Cursor': next_cursor,
+    }
+
+def page_headers(next_cursor):
+    """Link / X-Next-Cursor headers pointing to the following page"""
+    return next_page_headers(request.base_url, request.args.to_dict(), next_cursor)
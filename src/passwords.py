@@ -0,0 +1,111 @@
+"""
+Salted scrypt password hashes, stored as scrypt$<n>$<r>$<p>$<salt>$<hash> so the cost
+can be raised later without invalidating existing hashes.
+
+Hashing is deliberately slow, so it runs on a small bounded thread pool (hashlib.scrypt
+releases the GIL) instead of on the request thread. At most PASSWORD_HASH_MAX_PENDING
+hashes may be running or queued; beyond that callers get a 503 with Retry-After
+instead of piling up behind the pool.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from utils import Overloaded
+
+PREFIX = 'scrypt'
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+def b64encode(raw):
+    return base64.b64encode(raw).decode().rstrip('=')
+
+def b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+def scrypt(password, salt, n, r, p):
+    # scrypt needs 128 * r * n bytes, hashlib refuses anything above 32 MiB by default
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * r * n + 1024 * 1024, dklen=HASH_BYTES)
+
+def encode_hash(password, n, r, p):
+    salt = os.urandom(SALT_BYTES)
+    return '$'.join((PREFIX, str(n), str(r), str(p), b64encode(salt), b64encode(scrypt(password, salt, n, r, p))))
+
+def is_hashed(stored):
+    return stored.startswith(PREFIX + '$')
+
+def check_hash(stored, password):
+    """(matches, (n, r, p)) for a stored hash, plaintext legacy rows report no parameters"""
+    if not is_hashed(stored):
+        return hmac.compare_digest(stored.encode(), password.encode()), None
+    _, n, r, p, salt, expected = stored.split('$')
+    n, r, p = int(n), int(r), int(p)
+    return hmac.compare_digest(scrypt(password, b64decode(salt), n, r, p), b64decode(expected)), (n, r, p)
+
+class PasswordHasher:
+
+    def __init__(self, n=2 ** 14, r=8, p=1, workers=2, max_pending=8, queue_timeout=0.5):
+        if n < 2 or n & (n - 1):
+            raise ValueError('scrypt n must be a power of two')
+        self.params = (n, r, p)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.queue_timeout = queue_timeout
+        self.rejected = 0
+        self.dummy = None
+
+    def run(self, function, *args):
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            self.rejected += 1
+            raise Overloaded('Too many password operations in progress, retry shortly')
+        try:
+            future = self.pool.submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self.run(encode_hash, password, *self.params)
+
+    def verify(self, stored, password):
+        """
+        (matches, new_hash). new_hash is set when the password matched but the row holds
+        plaintext or was hashed with other parameters, so the caller can upgrade it.
+        """
+        matches, params = self.run(check_hash, stored, password)
+        if matches and params != self.params:
+            return True, self.hash(password)
+        return matches, None
+
+    def burn(self, password):
+        """Same amount of work as a failed verify, so unknown accounts answer as slowly as known ones"""
+        if self.dummy is None:
+            self.dummy = self.hash('dummy password')
+        self.run(check_hash, self.dummy, password)
+
+def init_passwords(app):
+    workers = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    app.config.setdefault('PASSWORD_SCRYPT_N', int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14)))
+    app.config.setdefault('PASSWORD_SCRYPT_R', int(os.environ.get('PASSWORD_SCRYPT_R', 8)))
+    app.config.setdefault('PASSWORD_SCRYPT_P', int(os.environ.get('PASSWORD_SCRYPT_P', 1)))
+    app.config.setdefault('PASSWORD_HASH_WORKERS', workers)
+    app.config.setdefault('PASSWORD_HASH_MAX_PENDING', int(os.environ.get('PASSWORD_HASH_MAX_PENDING', workers * 4)))
+    app.config.setdefault('PASSWORD_HASH_QUEUE_TIMEOUT', float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT', 0.5)))
+    app.extensions['passwords'] = PasswordHasher(
+        n=app.config['PASSWORD_SCRYPT_N'],
+        r=app.config['PASSWORD_SCRYPT_R'],
+        p=app.config['PASSWORD_SCRYPT_P'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+        queue_timeout=app.config['PASSWORD_HASH_QUEUE_TIMEOUT'],
+    )
+    return app.extensions['passwords']
+
+def get_hasher():
+    return current_app.extensions['passwords']
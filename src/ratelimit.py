@@ -0,0 +1,224 @@
+"""
+Token bucket rate limiting and admission control.
+
+Every client gets a bucket of RATELIMIT_BURST tokens refilled at RATELIMIT_RATE per
+second. A request spends its route's cost (ROUTE_COSTS, 1 by default) and gets a 429
+with Retry-After once the bucket runs dry. Clients are told apart by IP, or by their
+X-API-Key when it is one of RATELIMIT_API_KEYS. Unknown keys are ignored, otherwise a
+made up key would buy a fresh bucket.
+
+Behind a proxy every request comes from the proxy's address. Set RATELIMIT_PROXY_HOPS
+to the number of proxies that append to X-Forwarded-For and the client address is read
+that many entries from the right; entries further left are written by the client. The
+limiter is off unless RATELIMIT_ENABLED=1, with the wrong hop count it would put every
+client in one bucket.
+
+Buckets live in process memory, or in Redis (RATELIMIT_BACKEND=redis) so every
+worker shares them; REDIS_URL=fake:// stands in for Redis locally.
+
+MAX_CONCURRENT_REQUESTS caps the requests in flight per process. Requests beyond it
+get a 503 straight away instead of queueing until they time out.
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g, request
+from cache import redis_client
+from utils import Overloaded, RateLimited
+
+# full table walks and writes that fan out cost more than a single row lookup
+ROUTE_COSTS = {
+    'api.get_users': 5,
+    'api.get_characters': 5,
+    'api.get_planets': 5,
+    'api.get_starships': 5,
+    'api.get_user_favorites': 2,
+    'api.search': 3,
+    'api.export_resource': 50,
+    'api.create_bulk': 20,
+    'api.delete_bulk': 20,
+    'api.add_favorites_batch': 5,
+    # scrypt hashing, see passwords.py
+    'api.login': 10,
+    'api.create_user': 10,
+    'api.update_user': 5,
+    'api.prometheus_metrics': 0,
+}
+
+def refill(tokens, updated_at, now, rate, burst):
+    return min(burst, tokens + (now - updated_at) * rate)
+
+class MemoryBuckets:
+    """Buckets in a bounded LRU, idle clients are forgotten first"""
+
+    def __init__(self, rate, burst, max_entries=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, cost):
+        """(allowed, tokens left, seconds until `cost` tokens are available)"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = refill(tokens, updated_at, now, self.rate, self.burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return allowed, tokens, 0 if allowed else (cost - tokens) / self.rate
+
+class RedisBuckets:
+    """Buckets shared by every worker, each read-modify-write runs under the client's lock on that key"""
+
+    def __init__(self, client, rate, burst, namespace='ratelimit:', lock_timeout=0.05):
+        self.client = client
+        self.rate = rate
+        self.burst = burst
+        self.namespace = namespace
+        self.lock_timeout = lock_timeout
+        # a bucket left alone this long is full again, it can expire
+        self.ttl = int(burst / rate) + 1
+
+    def consume(self, key, cost):
+        name = self.namespace + key
+        lock = self.client.lock(name + ':lock', timeout=1, blocking_timeout=self.lock_timeout)
+        if not lock.acquire():
+            # another worker holds this client's bucket, refuse rather than let a burst slip past uncounted
+            return False, 0, self.lock_timeout
+        try:
+            now = time.time()
+            value = self.client.get(name)
+            if value is None:
+                tokens, updated_at = self.burst, now
+            else:
+                tokens, updated_at = (float(part) for part in value.decode().split(':'))
+            tokens = refill(tokens, updated_at, now, self.rate, self.burst)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self.client.set(name, '%f:%f' % (tokens, now), ex=self.ttl)
+        finally:
+            lock.release()
+        return allowed, tokens, 0 if allowed else (cost - tokens) / self.rate
+
+class RateLimiter:
+
+    def __init__(self, buckets, costs=None, max_concurrent=0, proxy_hops=0, api_keys=()):
+        self.buckets = buckets
+        self.costs = dict(ROUTE_COSTS, **(costs or {}))
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self.proxy_hops = proxy_hops
+        # digests only, the keys themselves never end up in memory dumps or Redis
+        self.api_keys = frozenset(key_digest(api_key) for api_key in api_keys)
+        self.limited = 0
+        self.shed = 0
+
+    def client_key(self, api_key, address):
+        if api_key:
+            digest = key_digest(api_key)
+            if digest in self.api_keys:
+                return 'key:' + digest
+        return 'ip:%s' % address
+
+    def cost(self, endpoint):
+        return self.costs.get(endpoint, 1)
+
+    def check(self, key, cost):
+        """Tokens left after paying `cost`, raises RateLimited when the bucket cannot pay it"""
+        if cost <= 0:
+            return None
+        allowed, remaining, wait = self.buckets.consume(key, cost)
+        if not allowed:
+            self.limited += 1
+            raise RateLimited('Too many requests, slow down', retry_after=max(1, int(wait + 0.999)))
+        return remaining
+
+    def enter(self):
+        """Takes an in-flight slot, raises Overloaded when every slot is busy"""
+        if self.slots is not None and not self.slots.acquire(blocking=False):
+            self.shed += 1
+            raise Overloaded('Server busy, retry shortly')
+
+    def leave(self):
+        if self.slots is not None:
+            self.slots.release()
+
+    def stats(self):
+        return {"limited": self.limited, "shed": self.shed, "max_concurrent": self.max_concurrent}
+
+def key_digest(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()[:32]
+
+def client_address(forwarded_for, remote_addr, proxy_hops):
+    """The X-Forwarded-For entry `proxy_hops` from the right, as ProxyFix(x_for=proxy_hops) picks it"""
+    if proxy_hops:
+        hops = [hop.strip() for hop in (forwarded_for or '').split(',') if hop.strip()]
+        if len(hops) >= proxy_hops:
+            return hops[-proxy_hops]
+    return remote_addr
+
+def request_client_key(limiter):
+    address = client_address(request.headers.get('X-Forwarded-For'), request.remote_addr, limiter.proxy_hops)
+    return limiter.client_key(request.headers.get('X-API-Key'), address)
+
+def before_request():
+    limiter = current_app.extensions['ratelimit']
+    if request.endpoint is None or not request.endpoint.startswith('api.'):
+        return
+    # admission first, a saturated worker should not even pay for the bucket lookup
+    limiter.enter()
+    g.ratelimit_slot = True
+    if current_app.config['RATELIMIT_ENABLED']:
+        remaining = limiter.check(request_client_key(limiter), limiter.cost(request.endpoint))
+        if remaining is not None:
+            g.ratelimit_remaining = remaining
+
+def after_request(response):
+    if 'ratelimit_remaining' in g:
+        response.headers['X-RateLimit-Remaining'] = str(int(g.ratelimit_remaining))
+    return response
+
+def teardown_request(exception=None):
+    if g.pop('ratelimit_slot', False):
+        current_app.extensions['ratelimit'].leave()
+
+def create_buckets(backend, rate, burst, redis_url=None):
+    if backend == 'memory':
+        return MemoryBuckets(rate, burst)
+    if backend == 'redis':
+        return RedisBuckets(redis_client(redis_url or 'redis://localhost:6379/0'), rate, burst)
+    raise ValueError('Unknown rate limit backend %r' % backend)
+
+def init_ratelimit(app):
+    app.config.setdefault('RATELIMIT_ENABLED', os.environ.get('RATELIMIT_ENABLED', '0') == '1')
+    app.config.setdefault('RATELIMIT_BACKEND', os.environ.get('RATELIMIT_BACKEND', 'memory'))
+    app.config.setdefault('RATELIMIT_RATE', float(os.environ.get('RATELIMIT_RATE', 20)))
+    app.config.setdefault('RATELIMIT_BURST', float(os.environ.get('RATELIMIT_BURST', 200)))
+    app.config.setdefault('RATELIMIT_COSTS', {})
+    app.config.setdefault('RATELIMIT_PROXY_HOPS', int(os.environ.get('RATELIMIT_PROXY_HOPS', 0)))
+    app.config.setdefault('RATELIMIT_API_KEYS', [key.strip() for key in os.environ.get('RATELIMIT_API_KEYS', '').split(',')
+                                                 if key.strip()])
+    app.config.setdefault('RATELIMIT_REDIS_URL', os.environ.get('REDIS_URL'))
+    app.config.setdefault('MAX_CONCURRENT_REQUESTS', int(os.environ.get('MAX_CONCURRENT_REQUESTS', 0)))
+    buckets = create_buckets(app.config['RATELIMIT_BACKEND'], app.config['RATELIMIT_RATE'],
+                             app.config['RATELIMIT_BURST'], app.config['RATELIMIT_REDIS_URL'])
+    app.extensions['ratelimit'] = RateLimiter(
+        buckets,
+        costs=app.config['RATELIMIT_COSTS'],
+        max_concurrent=app.config['MAX_CONCURRENT_REQUESTS'],
+        proxy_hops=app.config['RATELIMIT_PROXY_HOPS'],
+        api_keys=app.config['RATELIMIT_API_KEYS'],
+    )
+    if app.config['RATELIMIT_ENABLED'] or app.config['MAX_CONCURRENT_REQUESTS']:
+        app.before_request(before_request)
+        app.after_request(after_request)
+        app.teardown_request(teardown_request)
+    return app.extensions['ratelimit']
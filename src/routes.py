@@ -0,0 +1,420 @@
+"""
+API endpoints, registered on the app by create_app() in app.py
+"""
+from urllib.parse import urlencode
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from flask import Blueprint, current_app, request, jsonify, url_for
+from utils import APIException, generate_sitemap
+from pagination import keyset_page, page_headers
+from streaming import stream_response
+from bulk import bulk_add_favorites, parse_bulk_body, parse_bulk_ids
+from conditional import conditional
+from metrics import metrics_response
+from search import search_catalog
+from changes import read_changes
+from jobs import enqueue
+from popularity import popular_page
+from serializers import fetch_all, fetch_one
+from passwords import get_hasher
+from cache import get_cache, cached_json, list_key, item_key, invalidate
+from models import db, User,  Planets, Characters, Starships, Favorites, Job, CATALOG
+
+api = Blueprint('api', __name__)
+
+# Handle/serialize errors like a JSON object
+@api.app_errorhandler(APIException)
+def handle_invalid_usage(error):
+    response = jsonify(error.to_dict())
+    if getattr(error, 'retry_after', None) is not None:
+        response.headers['Retry-After'] = str(error.retry_after)
+    return response, error.status_code
+
+def accepted(job):
+    """202 for work handed to the job queue, the client follows Location for the outcome"""
+    return jsonify(job.serialize()), 202, {'Location': url_for('api.get_job', job_id=job.id)}
+
+def user_body(required=()):
+    """The JSON body of a user write, 400 unless it is an object with string fields and every `required` one"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise APIException('Expected a JSON object', status_code=400)
+    missing = [name for name in required if name not in body]
+    if missing:
+        raise APIException('Missing fields: ' + ', '.join(missing), status_code=400)
+    invalid = [name for name in ("username", "email", "password") if name in body and not isinstance(body[name], str)]
+    if invalid:
+        raise APIException('Must be strings: ' + ', '.join(invalid), status_code=400)
+    return body
+
+# generate sitemap with all your endpoints
+@api.route('/')
+def sitemap():
+    return generate_sitemap(current_app)
+
+# user methods
+
+@api.route('/user', methods=['GET'])
+@conditional('user')
+def get_users():
+    all_users = fetch_all(db.session, User)
+    if all_users == []:
+         raise APIException('There are no users', status_code=404)
+    return jsonify(all_users), 200
+
+@api.route('/user/<int:user_id>', methods=['GET'])
+@conditional('user')
+def get_one_user(user_id):
+    chosen_user = fetch_one(db.session, User, user_id)
+    if chosen_user is None:
+         raise APIException('User does not exist', status_code=404)
+    return jsonify(chosen_user), 200
+
+@api.route('/user', methods=['POST'])
+def create_user():
+    request_body_user = user_body(required=("username", "email", "password"))
+    password = get_hasher().hash(request_body_user["password"])
+    new_user = User(username=request_body_user["username"], email=request_body_user["email"], password=password)
+    db.session.add(new_user)
+    db.session.commit()
+    return jsonify(new_user.serialize()), 200
+
+@api.route('/user/<int:user_id>', methods=['PUT'])
+def update_user(user_id):
+    request_body_user = user_body()
+    chosen_user = User.query.get(user_id)
+    if chosen_user is None:
+        raise APIException('User not found', status_code=404)
+    if "username" in request_body_user:
+        chosen_user.username = request_body_user["username"]
+    if "password" in request_body_user:
+        chosen_user.password = get_hasher().hash(request_body_user["password"])
+    if "email" in request_body_user:
+        chosen_user.email = request_body_user["email"]
+    db.session.commit()
+    return jsonify(chosen_user.serialize()), 200
+
+@api.route('/user/<int:user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    if User.query.get(user_id) is None:
+        raise APIException('User not found', status_code=404)
+    # the user's favorites go first, in chunks, see bulk.bulk_delete
+    return accepted(enqueue(db.session, 'delete', {"resource": "user", "ids": [user_id]}))
+
+@api.route('/login', methods=['POST'])
+def login():
+    body = user_body()
+    password = body.get("password")
+    if password is None or not (body.get("email") or body.get("username")):
+        raise APIException('email or username and password are required', status_code=400)
+    if body.get("email"):
+        user = User.query.filter_by(email=body["email"]).first()
+    else:
+        user = User.query.filter_by(username=body["username"]).first()
+    hasher = get_hasher()
+    if user is None:
+        hasher.burn(password)
+        raise APIException('Invalid credentials', status_code=401)
+    matches, new_hash = hasher.verify(user.password, password)
+    if not matches:
+        raise APIException('Invalid credentials', status_code=401)
+    if new_hash is not None:
+        # plaintext or outdated cost parameters, upgraded now that we know the password
+        user.password = new_hash
+        db.session.commit()
+    return jsonify(user.serialize()), 200
+
+# favorites methods
+
+@api.route('/user/<int:user_id>/favorites', methods=['GET'])
+@conditional('user', 'favorites', 'characters', 'planets', 'starships')
+def get_user_favorites(user_id):
+    user = User.query.get(user_id)
+    if not user:
+        raise APIException('User not found', status_code=404)
+    if request.args.get('expand') in ('1', 'true'):
+        # one extra IN query per relationship instead of one query per favorite
+        query = Favorites.query.filter_by(user_id=user_id) \
+            .options(selectinload(Favorites.character), selectinload(Favorites.planet), selectinload(Favorites.starship))
+        serialized_favorites = [favorite.serialize_expanded() for favorite in query.all()]
+    else:
+        serialized_favorites = fetch_all(db.session, Favorites, Favorites.user_id == user_id)
+    if not serialized_favorites:
+        raise APIException('User has no favorites', status_code=404)
+    return jsonify(serialized_favorites), 200
+
+@api.route('/user/<int:user_id>/favorites/batch', methods=['POST'])
+def add_favorites_batch(user_id):
+    results = bulk_add_favorites(db.session, user_id)
+    return jsonify(results), 200
+
+@api.route('/user/<int:user_id>/favorites/characters/<int:character_id>', methods=['POST'])
+def add_character_favorite(user_id, character_id):
+    user = User.query.get(user_id)
+    if not user:
+        raise APIException('User not found', status_code=404)
+    character = Characters.query.get(character_id)
+    if not character:
+        raise APIException('Character not found', status_code=404)
+    favorite = Favorites(user_id=user_id, character_id=character_id)
+    db.session.add(favorite)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the (user_id, character_id) unique index catches duplicates, even concurrent ones
+        db.session.rollback()
+        raise APIException('The character is already on the favorites list', status_code=400)
+    return jsonify("Character added to favorites successfully"), 200
+
+@api.route('/user/<int:user_id>/favorites/characters/<int:character_id>', methods=['DELETE'])
+def delete_character_favorite(user_id, character_id):
+    favorite = Favorites.query.filter_by(user_id=user_id, character_id=character_id).first()
+    if not favorite:
+        raise APIException('Favorite not found', status_code=404)
+    db.session.delete(favorite)
+    db.session.commit()
+    return jsonify("Favorite successfully deleted"), 200
+
+@api.route('/user/<int:user_id>/favorites/planets/<int:planet_id>', methods=['POST'])
+def add_planet_favorite(user_id, planet_id):
+    user = User.query.get(user_id)
+    if not user:
+        raise APIException('User not found', status_code=404)
+    planet = Planets.query.get(planet_id)
+    if not planet:
+        raise APIException('Planet not found', status_code=404)
+    favorite = Favorites(user_id=user_id, planet_id=planet_id)
+    db.session.add(favorite)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the (user_id, planet_id) unique index catches duplicates, even concurrent ones
+        db.session.rollback()
+        raise APIException('The planet is already on the favorites list', status_code=400)
+    return jsonify("Planet added to favorites successfully"), 200
+
+@api.route('/user/<int:user_id>/favorites/planets/<int:planet_id>', methods=['DELETE'])
+def delete_planet_favorite(user_id, planet_id):
+    favorite = Favorites.query.filter_by(user_id=user_id, planet_id=planet_id).first()
+    if not favorite:
+        raise APIException('Favorite not found', status_code=404)
+    db.session.delete(favorite)
+    db.session.commit()
+    return jsonify("Favorite successfully deleted"), 200
+    
+@api.route('/user/<int:user_id>/favorites/starships/<int:starship_id>', methods=['POST'])
+def add_starship_favorite(user_id, starship_id):
+    user = User.query.get(user_id)
+    if not user:
+        raise APIException('User not found', status_code=404)
+    starship = Starships.query.get(starship_id)
+    if not starship:
+        raise APIException('Starship not found', status_code=404)
+    favorite = Favorites(user_id=user_id, starship_id=starship_id)
+    db.session.add(favorite)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the (user_id, starship_id) unique index catches duplicates, even concurrent ones
+        db.session.rollback()
+        raise APIException('The starship is already on the favorites list', status_code=400)
+    return jsonify("Starship added to favorites successfully"), 200
+
+@api.route('/user/<int:user_id>/favorites/starships/<int:starship_id>', methods=['DELETE'])
+def delete_starship_favorite(user_id, starship_id):
+    favorite = Favorites.query.filter_by(user_id=user_id, starship_id=starship_id).first()
+    if not favorite:
+        raise APIException('Favorite not found', status_code=404)
+    db.session.delete(favorite)
+    db.session.commit()
+    return jsonify("Favorite successfully deleted"), 200
+
+# characters methods
+
+@api.route('/characters', methods=['GET'])
+@conditional('characters')
+def get_characters():
+    def build():
+        results, next_cursor = keyset_page(db.session, Characters)
+        if results == []:
+            raise APIException('There are no characters', status_code=404)
+        return results, page_headers(next_cursor)
+    return cached_json(list_key('characters'), build)
+
+@api.route('/characters/<int:character_id>', methods=['GET'])
+@conditional('characters')
+def character(character_id):
+    def build():
+        character_query = fetch_one(db.session, Characters, character_id)
+        if character_query is None:
+            raise APIException('The character does not exist', status_code=404)
+        return character_query, None
+    return cached_json(item_key('characters', character_id), build)
+
+@api.route('/characters', methods=['POST'])
+def create_character():
+    request_body_user = request.get_json()
+    new_character = Characters(height=request_body_user["height"], mass=request_body_user["mass"], hair_color=request_body_user["hair_color"], skin_color=request_body_user["skin_color"], eye_color=request_body_user["eye_color"], birth_year=request_body_user["birth_year"], gender=request_body_user["gender"], name=request_body_user["name"])
+    db.session.add(new_character)
+    db.session.commit()
+    invalidate('characters')
+    return jsonify(request_body_user), 200
+
+@api.route('/characters/<int:character_id>', methods=['DELETE'])
+def delete_character(character_id):
+    if Characters.query.get(character_id) is None:
+        raise APIException('Character not found', status_code=404)
+    return accepted(enqueue(db.session, 'delete', {"resource": "characters", "ids": [character_id]}))
+
+# planets methods
+
+@api.route('/planets', methods=['GET'])
+@conditional('planets')
+def get_planets():
+    def build():
+        results, next_cursor = keyset_page(db.session, Planets)
+        if results == []:
+            raise APIException('There are no planets', status_code=404)
+        return results, page_headers(next_cursor)
+    return cached_json(list_key('planets'), build)
+
+@api.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional('planets')
+def planet(planet_id):
+    def build():
+        planet_query = fetch_one(db.session, Planets, planet_id)
+        if planet_query is None:
+            raise APIException('The planet does not exist', status_code=404)
+        return planet_query, None
+    return cached_json(item_key('planets', planet_id), build)
+
+@api.route('/planets', methods=['POST'])
+def create_planet():
+    request_body_user = request.get_json()
+    new_planet = Planets(diameter=request_body_user["diameter"], rotation_period=request_body_user["rotation_period"], orbital_period=request_body_user["orbital_period"], gravity=request_body_user["gravity"], population=request_body_user["population"], climate=request_body_user["climate"], terrain=request_body_user["terrain"], surface_water=request_body_user["surface_water"], name=request_body_user["name"])
+    db.session.add(new_planet)
+    db.session.commit()
+    invalidate('planets')
+    return jsonify(request_body_user), 200
+
+@api.route('/planets/<int:planet_id>', methods=['DELETE'])
+def delete_planet(planet_id):
+    if Planets.query.get(planet_id) is None:
+        raise APIException('Planet not found', status_code=404)
+    return accepted(enqueue(db.session, 'delete', {"resource": "planets", "ids": [planet_id]}))
+
+# starships methods
+
+@api.route('/starhips', methods=['GET'])
+@conditional('starships')
+def get_starships():
+    def build():
+        results, next_cursor = keyset_page(db.session, Starships)
+        if results == []:
+            raise APIException('There are no starships', status_code=404)
+        return results, page_headers(next_cursor)
+    return cached_json(list_key('starships'), build)
+
+@api.route('/starships/<int:starship_id>', methods=['GET'])
+@conditional('starships')
+def starship(starship_id):
+    def build():
+        starship_query = fetch_one(db.session, Starships, starship_id)
+        if starship_query is None:
+            raise APIException('The starship does not exist', status_code=404)
+        return starship_query, None
+    return cached_json(item_key('starships', starship_id), build)
+
+@api.route('/starships', methods=['POST'])
+def create_starship():
+    request_body_user = request.get_json()
+    new_starship = Starships(model=request_body_user["model"], starship_class=request_body_user["starship_class"], manufacturer=request_body_user["manufacturer"], cost_in_credits=request_body_user["cost_in_credits"], length=request_body_user["length"], crew=request_body_user["crew"], passengers=request_body_user["passengers"], max_atmosphering_speed=request_body_user["max_atmosphering_speed"], hyperdrive_rating=request_body_user["hyperdrive_rating"], MGLT=request_body_user["MGLT"], cargo_capacity=request_body_user["cargo_capacity"], consumables=request_body_user["consumables"], name=request_body_user["name"])
+    db.session.add(new_starship)
+    db.session.commit()
+    invalidate('starships')
+    return jsonify(request_body_user), 200
+
+@api.route('/starships/<int:starship_id>', methods=['DELETE'])
+def delete_starship(starship_id):
+    if Starships.query.get(starship_id) is None:
+        raise APIException('Starship not found', status_code=404)
+    return accepted(enqueue(db.session, 'delete', {"resource": "starships", "ids": [starship_id]}))
+
+@api.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(get_cache().stats()), 200
+
+# bulk methods
+
+@api.route('/<resource>/bulk', methods=['POST'])
+def create_bulk(resource):
+    if resource not in CATALOG:
+        raise APIException('Unknown resource', status_code=404)
+    return accepted(enqueue(db.session, 'bulk_create', {"resource": resource, "items": parse_bulk_body()}))
+
+@api.route('/<resource>/bulk', methods=['DELETE'])
+def delete_bulk(resource):
+    if resource not in CATALOG:
+        raise APIException('Unknown resource', status_code=404)
+    return accepted(enqueue(db.session, 'delete', {"resource": resource, "ids": parse_bulk_ids()}))
+
+@api.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return metrics_response()
+
+# search methods
+
+@api.route('/search', methods=['GET'])
+@conditional('characters', 'planets', 'starships')
+def search():
+    results, next_offset = search_catalog(db.session, request.args)
+    headers = {}
+    if next_offset is not None:
+        args = request.args.to_dict()
+        args['offset'] = next_offset
+        headers['Link'] = '<%s?%s>; rel="next"' % (request.base_url, urlencode(args))
+    return jsonify(results), 200, headers
+
+# sync methods
+
+@api.route('/changes', methods=['GET'])
+# changes_horizon too, a compaction must turn a cached page into a 410
+@conditional('characters', 'planets', 'starships', 'favorites', 'changes_horizon')
+def get_changes():
+    payload, settling = read_changes(db.session, request.args, current_app.config['CHANGES_GRACE_SECONDS'])
+    response = jsonify(payload)
+    if settling:
+        # the page grows once the grace runs out, with no write to move the ETag
+        response.cache_control.no_store = True
+    return response, 200
+
+# stats methods
+
+@api.route('/stats/popular/<resource>', methods=['GET'])
+@conditional('characters', 'planets', 'starships', 'favorites')
+def popular(resource):
+    model = CATALOG.get(resource)
+    if model is None:
+        raise APIException('Unknown resource', status_code=404)
+    results, next_cursor = popular_page(db.session, model, request.args)
+    return jsonify(results), 200, page_headers(next_cursor)
+
+# job methods
+
+@api.route('/jobs/<int:job_id>', methods=['GET'])
+def get_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None:
+        raise APIException('Job not found', status_code=404)
+    return jsonify(job.serialize()), 200
+
+# export methods
+
+EXPORTS = dict(CATALOG, users=User)
+
+@api.route('/export/<resource>', methods=['GET'])
+def export_resource(resource):
+    model = EXPORTS.get(resource)
+    if model is None:
+        raise APIException('Unknown resource', status_code=404)
+    return conditional(model.__tablename__)(stream_response)(db.session, model, request.args)
@@ -0,0 +1,104 @@
+"""
+Name search across characters, planets and starships.
+
+SQLite: an FTS5 table (catalog_search) kept in sync by triggers, so every write path,
+bulk inserts included, updates the index. The migrations create both, and so does
+models.py for databases built with db.metadata.create_all(). Results are ranked with bm25, name hits
+weigh more than the descriptive columns.
+PostgreSQL: ILIKE on name, served by the pg_trgm GIN indexes the migration creates.
+Other engines: LIKE 'prefix%' on the unique name index.
+"""
+import re
+from sqlalchemy import Integer, column, false, text
+from sqlalchemy.exc import OperationalError
+from utils import APIException
+from models import CATALOG
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+def match_expression(q):
+    # every word must match as a prefix: "sky walk" -> "sky"* "walk"*
+    tokens = TOKEN_RE.findall(q)
+    return ' '.join('"%s"*' % token for token in tokens)
+
+def fts_search(session, q, resources, limit, offset):
+    expression = match_expression(q)
+    if not expression:
+        return []
+    codes = ', '.join("'%s'" % resource for resource in resources)
+    rows = session.execute(text(
+        "SELECT resource, entity_id, name, bm25(catalog_search, 0, 0, 10.0, 1.0) AS rank "
+        "FROM catalog_search WHERE catalog_search MATCH :expression AND resource IN (%s) "
+        "ORDER BY rank, length(name) LIMIT :limit OFFSET :offset" % codes
+    ), {"expression": expression, "limit": limit, "offset": offset})
+    return [{"resource": row.resource, "id": row.entity_id, "name": row.name, "rank": row.rank} for row in rows]
+
+def like_condition(model, q, substring):
+    escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    if substring:
+        return model.name.ilike('%' + escaped + '%', escape='\\')
+    return model.name.like(escaped + '%', escape='\\')
+
+def name_condition(session, resource, q):
+    """WHERE clause matching `q` against one resource's names, served by the same indexes as /search"""
+    model = CATALOG[resource]
+    dialect = session.get_bind().dialect.name
+    if dialect != 'sqlite':
+        return like_condition(model, q, dialect == 'postgresql')
+    expression = match_expression(q)
+    if not expression:
+        return false()
+    matches = text(
+        "SELECT entity_id FROM catalog_search WHERE catalog_search MATCH :expression AND resource = :resource"
+    ).bindparams(expression='name : (%s)' % expression, resource=resource).columns(column('entity_id', Integer))
+    return model.id.in_(matches)
+
+def like_search(session, q, resources, limit, offset):
+    substring = session.get_bind().dialect.name == 'postgresql'
+    results = []
+    for resource in resources:
+        model = CATALOG[resource]
+        condition = like_condition(model, q, substring)
+        # each table only needs to supply enough rows to fill the merged page
+        query = session.query(model.id, model.name).filter(condition).order_by(model.name).limit(offset + limit)
+        results += [{"resource": resource, "id": row.id, "name": row.name, "rank": None} for row in query]
+    # names starting with the query first, then alphabetical
+    lowered = q.lower()
+    results.sort(key=lambda item: (not item["name"].lower().startswith(lowered), item["name"].lower()))
+    return results[offset:offset + limit]
+
+def parse_int(args, name, default, maximum=None):
+    try:
+        value = int(args.get(name, default))
+    except ValueError:
+        raise APIException('%s must be an integer' % name, status_code=400)
+    if value < 0:
+        raise APIException('%s must not be negative' % name, status_code=400)
+    return min(value, maximum) if maximum else value
+
+def search_catalog(session, args):
+    """Returns (results, next_offset) for ?q=&resource=&limit=&offset="""
+    q = (args.get('q') or '').strip()
+    if not q:
+        raise APIException('q is required', status_code=400)
+    resource = args.get('resource')
+    if resource is not None and resource not in CATALOG:
+        raise APIException('Unknown resource', status_code=400)
+    resources = [resource] if resource else list(CATALOG)
+    limit = max(1, parse_int(args, 'limit', DEFAULT_LIMIT, MAX_LIMIT))
+    offset = parse_int(args, 'offset', 0)
+
+    if session.get_bind().dialect.name == 'sqlite':
+        try:
+            results = fts_search(session, q, resources, limit + 1, offset)
+        except OperationalError as error:
+            if 'catalog_search' not in str(error.orig):
+                raise
+            session.rollback()
+            raise APIException('Search index is missing, run `flask db upgrade`', status_code=503)
+    else:
+        results = like_search(session, q, resources, limit + 1, offset)
+    next_offset = offset + limit if len(results) > limit else None
+    return results[:limit], next_offset
@@ -0,0 +1,58 @@
+"""
+Row based serialization: handlers select plain column tuples instead of hydrating
+ORM instances, turn them into dicts with key tuples compiled once at import time,
+and encode with orjson when it is installed (stdlib json otherwise).
+"""
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+from models import User, Favorites, Characters, Planets, Starships
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+def serialized_columns(model):
+    # (output key, column name) pairs in the same order as model.serialize()
+    aliases = getattr(model, 'serialize_aliases', {})
+    return [(aliases.get(name, name), name) for name in model.serialize_fields]
+
+# compiled once, every request reuses them
+SERIALIZED_COLUMNS = {model: serialized_columns(model) for model in (User, Favorites, Characters, Planets, Starships)}
+
+def columns_for(model, fields=None):
+    return [getattr(model, name) for _, name in fields or SERIALIZED_COLUMNS[model]]
+
+def keys_for(model, fields=None):
+    return tuple(key for key, _ in fields or SERIALIZED_COLUMNS[model])
+
+def rows_to_dicts(keys, rows):
+    # zip stops at the shorter side, extra trailing columns (sort values) are dropped
+    return [dict(zip(keys, row)) for row in rows]
+
+def fetch_all(session, model, *criteria):
+    """serialize() dicts for every row matching `criteria`, ordered by id"""
+    statement = select(*columns_for(model)).where(*criteria).order_by(model.id)
+    return rows_to_dicts(keys_for(model), session.execute(statement))
+
+def fetch_one(session, model, item_id):
+    """serialize() dict for one row, None when it does not exist"""
+    row = session.execute(select(*columns_for(model)).where(model.id == item_id)).first()
+    return dict(zip(keys_for(model), row)) if row is not None else None
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify() and the cache"""
+
+    def dumps(self, obj, **kwargs):
+        # jsonify() asks for compact separators, which is orjson's only layout;
+        # pretty printing (debug mode) or other options go through the stdlib encoder
+        if orjson is None or set(kwargs) - {'separators'}:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
@@ -0,0 +1,50 @@
+"""
+Streams whole tables as JSON or NDJSON without loading them in memory
+"""
+from flask import Response, current_app, stream_with_context
+from sqlalchemy import select
+from pagination import parse_fields
+from serializers import columns_for, keys_for
+
+CHUNK_SIZE = 1000
+
+def iter_rows(session, model, fields, chunk_size=CHUNK_SIZE):
+    statement = select(*columns_for(model, fields)).order_by(model.id)
+    keys = keys_for(model, fields)
+    # yield_per turns on server side cursors where the driver supports them
+    for row in session.execute(statement.execution_options(yield_per=chunk_size)):
+        yield dict(zip(keys, row))
+
+def iter_chunks(rows, chunk_size=CHUNK_SIZE):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def generate_json_array(rows, dumps):
+    yield '['
+    first = True
+    for chunk in iter_chunks(rows):
+        body = ','.join(dumps(row) for row in chunk)
+        yield body if first else ',' + body
+        first = False
+    yield ']'
+
+def generate_ndjson(rows, dumps):
+    for chunk in iter_chunks(rows):
+        yield ''.join(dumps(row) + '\n' for row in chunk)
+
+def stream_response(session, model, args):
+    """Response that encodes `model` chunk by chunk, ?format=ndjson switches to one object per line"""
+    fields = parse_fields(model, args.get('fields'))
+    rows = iter_rows(session, model, fields)
+    dumps = current_app.json.dumps
+    if args.get('format') == 'ndjson':
+        body, mimetype = generate_ndjson(rows, dumps), 'application/x-ndjson'
+    else:
+        body, mimetype = generate_json_array(rows, dumps), 'application/json'
+    return Response(stream_with_context(body), mimetype=mimetype)
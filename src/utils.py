@@ -15,13 +15,27 @@ class APIException(Exception):
         rv['message'] = self.message
         return rv
 
+class Overloaded(APIException):
+    """503 with a Retry-After header, raised when a bounded resource is saturated"""
+
+    def __init__(self, message, retry_after=1):
+        APIException.__init__(self, message, status_code=503)
+        self.retry_after = retry_after
+
+class RateLimited(APIException):
+    """429 with a Retry-After header, the client spent its token bucket"""
+
+    def __init__(self, message, retry_after=1):
+        APIException.__init__(self, message, status_code=429)
+        self.retry_after = retry_after
+
 def has_no_empty_params(rule):
     defaults = rule.defaults if rule.defaults is not None else ()
     arguments = rule.arguments if rule.arguments is not None else ()
     return len(defaults) >= len(arguments)
 
 def generate_sitemap(app):
-    links = ['/admin/']
+    links = ['/admin/'] if 'admin' in app.extensions else []
     for rule in app.url_map.iter_rules():
         # Filter out rules we can't navigate to in a browser
         # and rules that require parameters